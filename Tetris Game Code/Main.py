@@ -1,8 +1,15 @@
 import tkinter as tk
-import random, time, pygame, sys
+import random, time, pygame, sys, argparse, multiprocessing
 from pygame.locals import *
-import copy
+from concurrent.futures import wait, FIRST_COMPLETED
 from PIL import Image, ImageTk
+from engine import *
+import training
+import optimizers
+import corpus
+import metrics
+import runlog
+import experiments
 
 ##############################################################################
 # SETTING UP GENERAL CONSTANTS
@@ -14,9 +21,6 @@ FPS          = 30
 WINDOWWIDTH  = 650
 WINDOWHEIGHT = 690
 BOXSIZE      = 25
-BOARDWIDTH   = 10
-BOARDHEIGHT  = 25
-BLANK        = '.'
 XMARGIN      = int((WINDOWWIDTH - BOARDWIDTH * BOXSIZE) / 2)
 TOPMARGIN    = WINDOWHEIGHT - (BOARDHEIGHT * BOXSIZE) - 5
 
@@ -53,125 +57,7 @@ LIGHTCOLORS     = (LIGHTBLUE, LIGHTGREEN, LIGHTRED, LIGHTYELLOW)
 
 # Each color must have light color
 assert len(COLORS) == len(LIGHTCOLORS)
-
-# Piece Templates
-# The TEMPLATEWIDTH and TEMPLATEHEIGHT constants simply set how large each row
-# and column for each shape’s rotation should be
-TEMPLATEWIDTH  = 5
-TEMPLATEHEIGHT = 5
-
-S_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '..OO.',
-                     '.OO..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '...O.',
-                     '.....']]
-
-Z_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '.O...',
-                     '.....']]
-
-I_SHAPE_TEMPLATE = [['..O..',
-                     '..O..',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     'OOOO.',
-                     '.....',
-                     '.....']]
-
-O_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '.OO..',
-                     '.....']]
-
-J_SHAPE_TEMPLATE = [['.....',
-                     '.O...',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..OO.',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '...O.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '.OO..',
-                     '.....']]
-
-L_SHAPE_TEMPLATE = [['.....',
-                     '...O.',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '.O...',
-                     '.....'],
-                    ['.....',
-                     '.OO..',
-                     '..O..',
-                     '..O..',
-                     '.....']]
-
-T_SHAPE_TEMPLATE = [['.....',
-                     '..O..',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '..O..',
-                     '.....']]
-
-PIECES = {
-        'S': S_SHAPE_TEMPLATE,
-          'Z': Z_SHAPE_TEMPLATE,
-          'J': J_SHAPE_TEMPLATE,
-          'L': L_SHAPE_TEMPLATE,
-          'I': I_SHAPE_TEMPLATE,
-          'O': O_SHAPE_TEMPLATE,
-          'T': T_SHAPE_TEMPLATE
-          }
-
+assert len(COLORS) == COLOR_COUNT
 
 # Genetic Algorithm Configs
 EVOLUTIONS_NUMBER = 10
@@ -180,6 +66,120 @@ SELECTION_RATE = 0.5
 POPULATION_SIZE = 12
 CHROMOSOME_LENGTH = 7
 
+# Optimizer of the generational training loop: 'ga' (genetic algorithm) or
+# 'cem' (noisy cross-entropy method: POPULATION_SIZE chromosomes sampled per
+# generation, refit to the CEM_ELITE_RATE best, with CEM_NOISE extra variance
+# decreasing by CEM_NOISE_DECAY per generation)
+OPTIMIZER       = 'ga'
+CEM_ELITE_RATE  = 0.25
+CEM_INITIAL_STD = 5.0
+CEM_NOISE       = 4.0
+CEM_NOISE_DECAY = 0.5
+
+# Every genetic algorithm game gets its own piece sequence, seeded from the GA
+# random state. With COMMON_PIECE_SEQUENCES all the chromosomes of a
+# generation play the same sequence, so their scores compare directly.
+COMMON_PIECE_SEQUENCES = False
+
+# With FIXED_PIECE_SEQUENCES the piece seeds are drawn once for the whole run
+# instead of every generation (all chromosomes then always play the same
+# pieces), so surviving elites can reuse their cached results
+FIXED_PIECE_SEQUENCES = False
+
+# Headless game results are cached by chromosome, piece seed and budget; with
+# a file name they are also kept there and reused by later runs (None: memory only)
+FITNESS_CACHE_FILE = None
+
+# Processes playing the games of a generation in parallel in headless mode
+# (1: play them one after another in this process)
+WORKERS_NUMBER = 1
+
+# Play all the games of a generation together with the NumPy batch simulator
+# in headless mode (needs numpy; takes the place of the worker processes)
+BATCH_EVALUATION = False
+
+# Checkpoint of the generational training loop: the optimizer, random state
+# and the games already played are saved to CHECKPOINT_FILE at the start of
+# every generation and at most every CHECKPOINT_INTERVAL seconds during it,
+# and a run finding the file resumes from it (None: no checkpoints)
+CHECKPOINT_FILE     = None
+CHECKPOINT_INTERVAL = 60
+
+# Island model in headless mode: ISLANDS_NUMBER populations of
+# POPULATION_SIZE chromosomes evolve in their own processes, and every
+# MIGRATION_INTERVAL generations each one sends its MIGRANTS_NUMBER best
+# chromosomes to the next island (1: a single population)
+ISLANDS_NUMBER     = 1
+MIGRATION_INTERVAL = 2
+MIGRANTS_NUMBER    = 1
+
+# Steady-state evolution in headless mode: no generations, every finished
+# game is inserted in the population (replacing its worst member if the new
+# chromosome beats it, or its oldest one) and a new offspring of the current
+# elites is sent to the free worker, for STEADY_STATE_EVALUATIONS games
+STEADY_STATE_EVALUATIONS = EVOLUTIONS_NUMBER * POPULATION_SIZE
+STEADY_STATE_REPLACEMENT = 'worst'
+
+# Corpus fitness in headless mode: instead of whole games, every chromosome of
+# a generation plays CORPUS_CONTINUATION pieces from the same CORPUS_SAMPLE_SIZE
+# board states of a corpus file. A corpus is made by playing CORPUS_GAMES
+# games of CORPUS_GAME_PIECES pieces with CORPUS_CHROMOSOME, saving the board
+# every CORPUS_INTERVAL pieces.
+CORPUS_SAMPLE_SIZE  = 20
+CORPUS_CONTINUATION = 50
+CORPUS_GAMES        = 5
+CORPUS_GAME_PIECES  = 1000
+CORPUS_INTERVAL     = 20
+CORPUS_CHROMOSOME   = [-1.42 , 7 ,-8 , -2.41 , 8,6,8]
+
+# Racing evaluation in headless mode: every chromosome plays up to
+# RACE_ROUNDS games on piece sequences shared by the whole generation, and
+# the ones whose fitness (mean score of the games that ended, or points per
+# piece when every game was censored) is RACE_CONFIDENCE standard errors
+# below the selection cutoff (checked from RACE_MIN_ROUNDS games on) stop
+# early (0: no racing, one game per chromosome)
+RACE_ROUNDS     = 0
+RACE_MIN_ROUNDS = 3
+RACE_CONFIDENCE = 2.0
+
+# Budget of every genetic algorithm game: pieces placed and seconds played
+# (None: no limit). Games stopped by it are recorded as censored.
+GAME_PIECES_BUDGET = None
+GAME_TIME_BUDGET   = None
+
+# Beast Mode lookahead: plies searched ahead, boards kept per ply (None:
+# all of them) and seconds allowed per move (None: no limit). Only the
+# falling and next pieces are known: plies beyond them take the worst case
+# over every shape, so the game rules do not change with the depth. Each
+# of these plies searches every shape on every board of the beam: keep a
+# small BEAM_WIDTH with them.
+SEARCH_DEPTH     = 2
+BEAM_WIDTH       = None
+MOVE_TIME_BUDGET = None
+
+# Boards whose scored moves are kept between Beast Mode moves (0: no cache)
+TRANSPOSITION_TABLE_SIZE = 10000
+
+# Structured log of the training runs and Beast Mode games: one JSON line
+# per evaluation (run id, generation, genes, seed, result, time), see runlog.py
+RESULTS_LOG_FILE = "results.jsonl"
+
+# SQLite experiment store gathering the games of every run, to query them
+# across runs (python experiments.py FILE ...) and reuse their results in
+# headless mode (None: no store)
+STORE_FILE = None
+
+# Print the time spent in every phase (move generation, line clearing,
+# drawing, logging...) of each game and generation (see engine.Profiler)
+PROFILING = False
+
+# Live metrics (pieces and lines per second, scores, board height, worker
+# utilization, cache hit rates) of the training runs and Beast Mode games:
+# JSON file rewritten every METRICS_INTERVAL seconds and local HTTP port
+# serving it (None: not exported)
+METRICS_FILE     = None
+METRICS_PORT     = None
+METRICS_INTERVAL = 5
 
 # Define if the game is manual or not
 MANUAL_GAME = False
@@ -214,7 +214,7 @@ def display_menu():
         if selection == 1:
             RunTetrisNormally()
         elif selection == 2:
-            RunTetrisGeneticAlgorithm()
+            RunTetrisGeneticAlgorithm(profile=PROFILING)
         elif selection == 3:
             RunTetrisBeastMode()
 
@@ -313,104 +313,6 @@ def calc_level_and_fall_freq(score):
     return level, fall_freq+1
 
 
-def get_new_piece():
-    """Return a random new piece in a random rotation and color"""
-
-    shape= random.choice(list(PIECES.keys()))
-
-    new_piece = {'shape': shape,
-                'rotation': random.randint(0, len(PIECES[shape]) - 1),
-                'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
-                'y': -2, # start it above the board (i.e. less than 0)
-                'color': random.randint(0, len(COLORS)-1)}
-
-    return new_piece
-
-
-def add_to_board(board, piece):
-    """Fill in the board based on piece's location, shape, and rotation"""
-
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            if PIECES[piece['shape']][piece['rotation']][y][x] != BLANK:
-                board[x + piece['x']][y + piece['y']] = piece['color']
-
-
-def get_blank_board():
-    """Create and return a new blank board data structure"""
-
-    board = []
-    for i in range(BOARDWIDTH):
-        board.append([BLANK] * BOARDHEIGHT)
-
-    return board
-
-
-def is_on_board(x, y):
-    """Check if the piece is on the board"""
-
-    return x >= 0 and x < BOARDWIDTH and y < BOARDHEIGHT
-
-
-def is_valid_position(board, piece, adj_X=0, adj_Y=0):
-    """Return True if the piece is within the board and not colliding"""
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            is_above_board = y + piece['y'] + adj_Y < 0
-            if is_above_board or PIECES[piece['shape']][piece['rotation']][y][x] == BLANK:
-                continue
-
-            if not is_on_board(x + piece['x'] + adj_X, y + piece['y'] + adj_Y):
-                return False
-
-            if board[x + piece['x'] + adj_X][y + piece['y'] + adj_Y] != BLANK:
-                return False
-
-    return True
-
-
-def is_complete_line(board, y):
-    """Return True if the line filled with boxes with no gaps"""
-
-    for x in range(BOARDWIDTH):
-        if board[x][y] == BLANK:
-            return False
-
-    return True
-
-
-def remove_complete_lines(board):
-    """Remove any completed lines on the board.
-
-    After remove any completed lines, move everything above them dowm and
-    return the number of complete lines.
-
-    """
-    num_removed_lines = 0
-    y = BOARDHEIGHT - 1     # Start y at the bottom of the board
-
-    while y >= 0:
-        if is_complete_line(board, y):
-            # Remove the line and pull boxes down by one line.
-            for pullDownY in range(y, 0, -1):
-                for x in range(BOARDWIDTH):
-                    board[x][pullDownY] = board[x][pullDownY-1]
-
-            # Set very top line to blank.
-            for x in range(BOARDWIDTH):
-                board[x][0] = BLANK
-
-            num_removed_lines += 1
-
-            # Note on the next iteration of the loop, y is the same.
-            # This is so that if the line that was pulled down is also
-            # complete, it will be removed.
-        else:
-            y -= 1  # Move on to check next row up
-
-    return num_removed_lines
-
-
 def conv_to_pixels_coords(boxx, boxy):
     """Convert the given xy coordinates to the screen coordinates
 
@@ -547,7 +449,7 @@ def draw_statusBeastMode(score, level, total_lines_removed,moves_taken,current_c
 def draw_piece(piece, pixelx=None, pixely=None):
     """Draw piece"""
 
-    shape_to_draw = PIECES[piece['shape']][piece['rotation']]
+    shape_to_draw = PIECE_TABLE[piece['shape']][piece['rotation']]
 
     if pixelx == None and pixely == None:
         # If pixelx and pixely hasn't been specified, use the location stored
@@ -555,10 +457,8 @@ def draw_piece(piece, pixelx=None, pixely=None):
         pixelx, pixely = conv_to_pixels_coords(piece['x'], piece['y'])
 
     # Draw each of the boxes that make up the piece
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            if shape_to_draw[y][x] != BLANK:
-                draw_box(None, None, piece['color'], pixelx + (x * BOXSIZE), pixely + (y * BOXSIZE))
+    for x, y in shape_to_draw['cells']:
+        draw_box(None, None, piece['color'], pixelx + (x * BOXSIZE), pixely + (y * BOXSIZE))
 
 
 def draw_next_piece(piece):
@@ -574,183 +474,24 @@ def draw_next_piece(piece):
     draw_piece(piece, pixelx=WINDOWWIDTH-150, pixely=160)
 
 
-##############################################################################
-# GAME STATISTICS FUNCTIONS
-##############################################################################
-
-def calc_move_info(board, piece, x, r, total_holes_bef, total_blocking_bloks_bef):
-    """Calculate informations based on the current play"""
-
-    piece['rotation'] = r
-    piece['y']        = 0
-    piece['x']        = x
-
-    # Check if it's a valid position
-    if (not is_valid_position(board, piece)):
-        return [False]
-
-    # Goes down the piece while it's a valid position
-    while is_valid_position(board, piece, adj_X=0, adj_Y=1):
-        piece['y']+=1
-
-    # Create a hypothetical board
-    new_board = get_blank_board()
-    for x2 in range(BOARDWIDTH):
-        for y in range(BOARDHEIGHT):
-            new_board[x2][y] = board[x2][y]
-
-    # Add the piece to the new_board
-    add_to_board(new_board, piece)
-
-    # Calculate the sides in contact
-    piece_sides, floor_sides, wall_sides = calc_sides_in_contact(board, piece)
-
-    # Calculate removed lines
-    num_removed_lines = remove_complete_lines(new_board)
-
-    total_blocking_block = 0
-    total_holes          = 0
-    max_height           = 0
-
-    for x2 in range(0, BOARDWIDTH):
-        b = calc_heuristics(new_board, x2)
-        total_holes += b[0]
-        total_blocking_block += b[1]
-        max_height += b[2]
-
-    new_holes           = total_holes - total_holes_bef
-    new_blocking_blocks = total_blocking_block - total_blocking_bloks_bef
-
-    return [True, max_height, num_removed_lines, new_holes, new_blocking_blocks, piece_sides, floor_sides, wall_sides]
-
-def calc_initial_move_info(board):
-    total_holes          = 0
-    total_blocking_bocks = 0
-
-    for x2 in range(0, BOARDWIDTH):
-        b = calc_heuristics(board, x2)
-
-        total_holes          += b[0]
-        total_blocking_bocks += b[1]
-
-    return total_holes, total_blocking_bocks
-
-def calc_heuristics(board, x):
-    """Calculate heuristics
-
-    The heuristics are composed by: number of holes, number of blocks above
-    hole and maximum height.
-
-    """
-    total_holes        = 0
-    locals_holes       = 0
-    blocks_above_holes = 0
-    is_hole_exist      = False
-    sum_heights        = 0
-
-    for y in range(BOARDHEIGHT-1, -1,-1):
-        if board[x][y] == BLANK:
-            locals_holes += 1
-        else:
-            sum_heights += BOARDHEIGHT-y
-
-            if locals_holes > 0:
-                total_holes += locals_holes
-                locals_holes = 0
-
-            if total_holes > 0:
-                blocks_above_holes += 1
-
-    return total_holes, blocks_above_holes, sum_heights
-
-def calc_sides_in_contact(board, piece):
-    """Calculate sides in contacts"""
-
-    piece_sides = 0
-    floor_sides = 0
-    wall_sides  = 0
-
-    for Px in range(TEMPLATEWIDTH):
-        for Py in range(TEMPLATEHEIGHT):
-
-            # Wall
-            if not PIECES[piece['shape']][piece['rotation']][Py][Px] == BLANK: # Quadrante faz parte da peça
-                if piece['x']+Px == 0 or piece['x']+Px == BOARDWIDTH-1:
-                    wall_sides += 1
-
-                if piece['y']+Py == BOARDHEIGHT-1:
-                    floor_sides += 1
-                else:
-                # Para outras opecas no contorno do template:
-                    if Py == TEMPLATEHEIGHT-1 and not board[piece['x']+Px][piece['y']+Py+1] == BLANK:
-                        piece_sides += 1
-
-                #os extremos do template sao colorido: confere se ha pecas do lado deles
-                if Px == 0 and piece['x']+Px > 0 and not board[piece['x']+Px-1][piece['y']+Py] == BLANK:
-                        piece_sides += 1
-
-                if Px == TEMPLATEWIDTH-1 and piece['x']+Px < BOARDWIDTH -1 and not board[piece['x']+Px+1][piece['y']+Py] == BLANK:
-                        piece_sides += 1
-
-            # Other pieces in general
-            elif piece['x']+Px < BOARDWIDTH and piece['x']+Px >= 0 and piece['y']+Py < BOARDHEIGHT and not board[piece['x']+Px][piece['y']+Py] == BLANK:  #quadrante do tabuleiro colorido mas nao do template
-
-                # O quadrante vazio do template esta colorido no tabuleiro
-                if not PIECES[piece['shape']][piece['rotation']][Py-1][Px] == BLANK:
-                    piece_sides += 1
-
-                if Px > 0 and not PIECES[piece['shape']][piece['rotation']][Py][Px-1] == BLANK:
-                    piece_sides += 1
-
-                if Px < TEMPLATEWIDTH-1 and not PIECES[piece['shape']][piece['rotation']][Py][Px+1] == BLANK:
-                    piece_sides += 1
-
-                    #(nao pode haver pecas em cima)
-
-    return  piece_sides, floor_sides, wall_sides
-
-
 ##############################################################################
 # GENETIC ALGORITHM
 ##############################################################################
 
-def GenerateAllPossibleMovesWithScores(board , piece, current_chromosome):
-    moves = []
-    for rotation in range(0 , len(PIECES[piece['shape']])):
-        for x in range(-2 , 8):
-            MoveInfo = calc_move_info(board , piece , x , rotation , 0 , 0)
-            isValidMove = MoveInfo[0]
-            if not isValidMove:
-                continue
-            move_score = CalculateFitnessScore(MoveInfo , current_chromosome)
-            moves.append((rotation, x, move_score))
-    return moves
-
-
-def chooseBestMove(moves):
-    moves.sort(key=lambda move: move[2] , reverse=True)
-    return moves[0]
-
-
-def Initalize_population():
+def Initalize_population(population_size=POPULATION_SIZE):
     population = []
     chromosome_size = 7
-    for i in range(0, POPULATION_SIZE):
+    for i in range(0, population_size):
         chromosome =[]
         for j in range(0, chromosome_size):
             chromosome.append(random.randint(-10,10))
         population.append(chromosome)
     return population
 
-def CalculateFitnessScore(MoveInfo , CurrentChromosome):
-    score = 0
-    for Feature , Value in zip(MoveInfo[1:],CurrentChromosome):
-        score += Feature * Value
-    return score
-
 def choose_Best_Chromosomes(population , ChoosingRate = 0.5 ):
+    """Keep the best [chromosome, score, moves taken, censored] entries (see calc_fitness)"""
     chromosomes_To_select = int(len(population) * ChoosingRate)
-    population.sort(key = lambda chromosomeWithScore:chromosomeWithScore[1] , reverse=True)
+    population.sort(key = lambda chromosomeWithScore:calc_fitness(*chromosomeWithScore[1:]) , reverse=True)
     return population[:chromosomes_To_select]
 
 
@@ -774,6 +515,30 @@ def Mutation(offSprings):
     return mutated_offspring
 
 
+def next_generation(population, immigrants=()):
+    """Select, cross over and mutate the [chromosome, score, moves taken, censored] entries
+
+    Immigrants from another island take the place of the worst selected
+    chromosomes before crossover.
+
+    """
+    best_chromosomes_With_Scores = choose_Best_Chromosomes(population, SELECTION_RATE)
+    best_chromosome = drop_score(best_chromosomes_With_Scores)
+    if immigrants:
+        best_chromosome = best_chromosome[:len(best_chromosome) - len(immigrants)] + list(immigrants)
+    offSprings = cross_over(best_chromosome)
+    mutated_offsprings = Mutation(offSprings)
+    return best_chromosome + mutated_offsprings
+
+
+def make_optimizer(name=OPTIMIZER):
+    """Create the ask/tell optimizer of the training loop ('ga' or 'cem')"""
+    if name == 'cem':
+        return optimizers.CrossEntropyOptimizer(POPULATION_SIZE, CHROMOSOME_LENGTH, CEM_ELITE_RATE, CEM_INITIAL_STD,
+                                                CEM_NOISE, CEM_NOISE_DECAY)
+    return optimizers.GeneticOptimizer(Initalize_population(), next_generation)
+
+
 def drop_score(Chromosoems_with_scores):
     Chromosomes_Without_Scores =[]
     for Chromosome in Chromosoems_with_scores:
@@ -894,11 +659,7 @@ def RunTetrisNormally():
                     moving_left  = False
                     moving_right = False
 
-                    for i in range(1, BOARDHEIGHT):
-                        if (not is_valid_position(board, falling_piece, adj_Y=i)):
-                            break
-
-                    falling_piece['y'] += i - 1
+                    drop_piece(board, falling_piece, get_skyline(board))
 
         # Handle moving the piece because of user input
         if (moving_left or moving_right) and time.time() - last_moveside_time > MOVESIDEWAYSFREQ:
@@ -960,7 +721,8 @@ def RunTetrisNormally():
 ##############################################################################
 
 
-def RunTetrisGeneticAlgorithm():
+def init_display():
+    """Initialize pygame and the window used by the renderers"""
     global FPSCLOCK, DISPLAYSURF, BASICFONT, BIGFONT
     pygame.init()
     FPSCLOCK    = pygame.time.Clock()
@@ -968,100 +730,508 @@ def RunTetrisGeneticAlgorithm():
     BASICFONT   = pygame.font.Font('freesansbold.ttf', 18)
     BIGFONT     = pygame.font.Font('freesansbold.ttf', 100)
     pygame.display.set_caption('Tetris AI')
-    f = open("scores.txt" , "a")
-    f.write("************************************************************************************************\n")
-    population = Initalize_population()
+
+
+def RunTetrisGeneticAlgorithm(headless=False, workers=WORKERS_NUMBER, race_rounds=RACE_ROUNDS,
+                              max_pieces=GAME_PIECES_BUDGET, time_limit=GAME_TIME_BUDGET,
+                              common_pieces=COMMON_PIECE_SEQUENCES, fixed_pieces=FIXED_PIECE_SEQUENCES,
+                              cache_file=FITNESS_CACHE_FILE, batch=BATCH_EVALUATION, optimizer=OPTIMIZER,
+                              corpus_file=None, checkpoint_file=CHECKPOINT_FILE, profile=PROFILING,
+                              store_file=STORE_FILE):
+    """Evolve the population
+
+    Args:
+        headless: evaluate chromosomes without any display at full CPU speed
+        workers: in headless mode, number of processes playing the games in
+            parallel. Results do not depend on which worker finishes first
+            since every game has its own piece seed.
+        race_rounds: in headless mode, maximum games per chromosome of the
+            racing evaluation (0: one game each, no racing)
+        max_pieces, time_limit: budget of every game (None: no limit)
+        common_pieces: all chromosomes of a generation play the same pieces
+        fixed_pieces: all chromosomes of every generation play the same
+            pieces (the seeds are drawn once)
+        cache_file: in headless mode, file keeping the game results between
+            runs (None: results are only cached during this run)
+        batch: in headless mode, play the games of a generation in lockstep
+            with the NumPy batch simulator instead of one by one (with
+            max_pieces only: the games cannot have their own time_limit)
+        optimizer: 'ga' or 'cem' (see make_optimizer)
+        corpus_file: in headless mode, score chromosomes on continuations of
+            the states of this corpus instead of whole games
+        checkpoint_file: file the run is saved to, and resumed from if it
+            exists (None: no checkpoints). In headless mode the games already
+            played are not played again on resume; the corpus fitness is
+            recomputed.
+        profile: print the phases of every game played in this process and
+            of every generation (evaluation, logging, checkpoint, breeding)
+        store_file: experiment store the run, its generations and (in
+            headless mode) its games are added to, and game results reused
+            from (None: no store)
+
+    """
+    if not headless:
+        init_display()
+    pool = None
+    if headless and workers > 1 and not batch:
+        pool = training.make_pool(workers)
+    checkpoint = None
+    if checkpoint_file is not None:
+        checkpoint = training.load_checkpoint(checkpoint_file)
+    log = runlog.RunLog(RESULTS_LOG_FILE, checkpoint['run_id'] if checkpoint is not None else None)
+    store = open_experiment_store(store_file, log.run_id, 'generational',
+                                  dict(optimizer=optimizer, race_rounds=race_rounds, max_pieces=max_pieces,
+                                       time_limit=time_limit, common_pieces=common_pieces, fixed_pieces=fixed_pieces,
+                                       batch=batch, corpus_file=corpus_file))
+    cache = None
+    if headless:
+        cache = training.FitnessCache(cache_file, store)
+    exporter = make_metrics_exporter()
+    if exporter is not None and cache is not None:
+        exporter.add_cache('fitness', cache)
+    states = None
+    if headless and corpus_file is not None:
+        states = corpus.load_states(corpus_file)
+    if checkpoint is None:
+        fixed_seeds = None
+        if fixed_pieces:
+            fixed_seeds = [random.randrange(2**32) for i in range(max(race_rounds, 1))]
+        optimizer = make_optimizer(optimizer)
+        first_evolution = 0
+    else:
+        # Back to the start of the saved generation: same population and
+        # piece seeds, and its games played so far come from the cache.
+        # The results logged in that generation are logged again.
+        fixed_seeds     = checkpoint['fixed_seeds']
+        optimizer       = checkpoint['optimizer']
+        first_evolution = checkpoint['evolution']
+        random.setstate(checkpoint['random_state'])
+        if cache is not None:
+            cache.entries.update(checkpoint['games'])
+
+    for Evolution in range(first_evolution, EVOLUTIONS_NUMBER):
+        profiler       = None
+        games_profiler = None
+        if profile:
+            profiler       = Profiler()
+            games_profiler = Profiler()
+
+        if exporter is not None:
+            exporter.set_value('evolution', Evolution)
+        if store is not None:
+            store.generation = Evolution
+        random_state = random.getstate()
+        log.flush()
+        save_run_checkpoint(checkpoint_file, Evolution, optimizer, random_state, fixed_seeds, cache, log.run_id)
+        saved_at = time.time()
+        if profiler is not None:
+            profiler.lap('checkpoint')
+
+        population = optimizer.ask()
+        results = [None] * len(population)
+        if profiler is not None:
+            profiler.lap('breeding')
+        for i, result, eliminated, seed, seconds in evaluate_generation(population, Evolution, headless, pool,
+                                                                        race_rounds, max_pieces, time_limit,
+                                                                        common_pieces, fixed_seeds, cache, batch,
+                                                                        states, games_profiler, exporter):
+            if profiler is not None:
+                profiler.lap('evaluation')
+            log.record(Evolution, i, population[i], seed, result, eliminated, seconds)
+            results[i] = result
+            if profiler is not None:
+                profiler.lap('logging')
+            if time.time() - saved_at > CHECKPOINT_INTERVAL:
+                log.flush()
+                save_run_checkpoint(checkpoint_file, Evolution, optimizer, random_state, fixed_seeds, cache,
+                                    log.run_id)
+                saved_at = time.time()
+                if profiler is not None:
+                    profiler.lap('checkpoint')
+        optimizer.tell(population, results)
+        if store is not None:
+            store.add_generation(Evolution, results)
+
+        if profiler is not None:
+            profiler.lap('breeding')
+            print(profiler.report(f"Evolution # {Evolution} profile"))
+            print(games_profiler.report(f"Evolution # {Evolution} games profile"))
+
+    log.close()
+    save_run_checkpoint(checkpoint_file, EVOLUTIONS_NUMBER, optimizer, random.getstate(), fixed_seeds, cache,
+                        log.run_id)
+
+    if pool is not None:
+        pool.shutdown()
+    if exporter is not None:
+        exporter.close()
+    if store is not None:
+        store.close()
+    if cache is not None:
+        print(f"Fitness cache: {cache.hits} hits, {cache.misses} misses")
+
+
+def open_experiment_store(path, run_id, mode, options):
+    """Open the experiments.ExperimentStore at path and begin the run in it (None if path is None)"""
+
+    if path is None:
+        return None
+
+    store = experiments.ExperimentStore(path)
+    store.begin_run(run_id, mode, options)
+
+    return store
+
+
+def make_metrics_exporter():
+    """Return the metrics.MetricsExporter of METRICS_FILE and METRICS_PORT, or None if both are None"""
+
+    if METRICS_FILE is None and METRICS_PORT is None:
+        return None
+
+    return metrics.MetricsExporter(METRICS_FILE, METRICS_PORT, METRICS_INTERVAL)
+
+
+def save_run_checkpoint(path, evolution, optimizer, random_state, fixed_seeds, cache, run_id):
+    """Save the state of RunTetrisGeneticAlgorithm at the start of a generation
+
+    Args:
+        path: checkpoint file (None: nothing is saved)
+        evolution: index of the generation, EVOLUTIONS_NUMBER once the run is over
+        optimizer: optimizer about to ask for that generation
+        random_state: random.getstate() before the optimizer was asked
+        fixed_seeds: piece seeds of FIXED_PIECE_SEQUENCES, or None
+        cache: FitnessCache whose games are saved along, or None
+        run_id: id of the run in the results log, kept when resuming
+
+    """
+    if path is None:
+        return
+
+    games = {} if cache is None else cache.entries
+    training.save_checkpoint(path, {'evolution': evolution, 'optimizer': optimizer, 'random_state': random_state,
+                                    'fixed_seeds': fixed_seeds, 'games': games, 'run_id': run_id})
+
+
+def collect_corpus(path, games=CORPUS_GAMES):
+    """Play CORPUS_CHROMOSOME games and save their mid-game states to a corpus file"""
+
+    states = []
+    for game in range(games):
+        states += corpus.collect_states(CORPUS_CHROMOSOME, random.randrange(2**32), CORPUS_INTERVAL, CORPUS_GAME_PIECES)
+    corpus.save_states(path, states)
+    print(f"Saved {len(states)} states to {path}")
+
+
+def RunTetrisIslandGeneticAlgorithm(islands=ISLANDS_NUMBER, migration_interval=MIGRATION_INTERVAL, **options):
+    """Evolve one population per island, each in its own process (headless)
+
+    Every island runs the usual selection, crossover and mutation on its own
+    population and random state. Migration is a ring: every
+    migration_interval generations an island sends copies of its best
+    chromosomes to the next island and takes in the ones waiting for it,
+    without waiting for the other islands. This process only logs the
+    results sent by the islands to the results log.
+
+    Args:
+        islands: number of islands (sub-populations of POPULATION_SIZE)
+        migration_interval: generations between two migrations
+        options: evaluation options of RunTetrisGeneticAlgorithm
+            (race_rounds, max_pieces, time_limit, common_pieces,
+            fixed_pieces, cache_file, batch, store_file). The games of
+            every island are added to the experiment store, but not the
+            generations.
+
+    """
+    log       = runlog.RunLog(RESULTS_LOG_FILE)
+    options   = dict(options, run_id=log.run_id)
+    inboxes   = [multiprocessing.Queue() for island in range(islands)]
+    results   = multiprocessing.Queue()
+    processes = []
+    for island in range(islands):
+        process = multiprocessing.Process(target=run_island,
+                                          args=(island, random.randrange(2**32), Initalize_population(), inboxes[island],
+                                                inboxes[(island + 1) % islands], results, migration_interval, options))
+        process.start()
+        processes.append(process)
+
+    running = islands
+    while running > 0:
+        message = results.get()
+        if message is None:
+            # An island finished its last generation
+            running -= 1
+            continue
+        island, Evolution, records = message
+        for i, chromosome, result, eliminated, seed, seconds in records:
+            log.record(Evolution, i, chromosome, seed, result, eliminated, seconds, island=island)
+        log.flush()
+    log.close()
+
+    for process in processes:
+        process.join()
+
+
+def run_island(island, seed, population, inbox, outbox, results, migration_interval, options):
+    """Evolve the population of one island, sending every generation's scores to results"""
+
+    random.seed(seed)
+    race_rounds = options.get('race_rounds', RACE_ROUNDS)
+    fixed_seeds = None
+    if options.get('fixed_pieces', FIXED_PIECE_SEQUENCES):
+        fixed_seeds = [random.randrange(2**32) for i in range(max(race_rounds, 1))]
+    options_saved = {name: value for name, value in options.items() if name not in ('store_file', 'run_id')}
+    store = open_experiment_store(options.get('store_file', STORE_FILE), options['run_id'], 'islands', options_saved)
+    cache = training.FitnessCache(options.get('cache_file', FITNESS_CACHE_FILE), store)
+
     for Evolution in range(0, EVOLUTIONS_NUMBER):
-        f.write(f"\t\t\t\t\t Evolution # {Evolution}\n")
+        if store is not None:
+            store.generation = Evolution
+        records = []
+        scores  = [None] * len(population)
+        for i, result, eliminated, seed, seconds in evaluate_generation(population, Evolution, True, None, race_rounds,
+                                                                        options.get('max_pieces', GAME_PIECES_BUDGET),
+                                                                        options.get('time_limit', GAME_TIME_BUDGET),
+                                                                        options.get('common_pieces',
+                                                                                    COMMON_PIECE_SEQUENCES),
+                                                                        fixed_seeds, cache,
+                                                                        options.get('batch', BATCH_EVALUATION)):
+            records.append((i, population[i], result, eliminated, seed, seconds))
+            score, moves_taken, linesRemoved, censored = result
+            scores[i] = [score, moves_taken, censored]
+        results.put((island, Evolution, records))
+        population = [[population[i]] + scores[i] for i in range(len(population))]
+
+        immigrants = []
+        if (Evolution + 1) % migration_interval == 0 and outbox is not inbox:
+            # Copies of the best chromosomes leave; whatever arrived comes in
+            best = drop_score(choose_Best_Chromosomes(population[:], SELECTION_RATE))
+            outbox.put([chromosome[:] for chromosome in best[:MIGRANTS_NUMBER]])
+            while not inbox.empty():
+                immigrants += inbox.get()
+            immigrants = immigrants[:int(len(population) * SELECTION_RATE)]
+
+        population = next_generation(population, immigrants)
+
+    if store is not None:
+        store.close()
+    results.put(None)
+
+
+def RunTetrisSteadyStateGeneticAlgorithm(workers=WORKERS_NUMBER, evaluations=STEADY_STATE_EVALUATIONS,
+                                         population_size=POPULATION_SIZE, replacement=STEADY_STATE_REPLACEMENT,
+                                         max_pieces=GAME_PIECES_BUDGET, time_limit=GAME_TIME_BUDGET,
+                                         common_pieces=COMMON_PIECE_SEQUENCES, fixed_pieces=FIXED_PIECE_SEQUENCES,
+                                         cache_file=FITNESS_CACHE_FILE, store_file=STORE_FILE, **options):
+    """Evolve the population without generations (headless)
+
+    Every worker always has a game to play: as soon as one finishes, its
+    chromosome is inserted in the population and the worker gets the next
+    chromosome, first the random initial ones, then offsprings bred with
+    cross_over and Mutation from the current elites (choose_Best_Chromosomes).
+
+    Args:
+        workers: number of processes playing games
+        evaluations: total number of games to play
+        population_size: number of chromosomes kept in the population
+        replacement: once the population is full, 'worst' replaces its worst
+            chromosome if the new one ranks higher (see calc_fitness), and
+            'oldest' always replaces the oldest one
+        max_pieces, time_limit: budget of every game (None: no limit)
+        common_pieces, fixed_pieces: every game plays the same pieces
+        cache_file: file keeping the game results between runs
+        store_file: experiment store the games are added to and reused from
+        options: other RunTetrisGeneticAlgorithm options, unused here
+
+    """
+    pool     = training.make_pool(workers)
+    log      = runlog.RunLog(RESULTS_LOG_FILE)
+    store    = open_experiment_store(store_file, log.run_id, 'steady state',
+                                     dict(evaluations=evaluations, population_size=population_size,
+                                          replacement=replacement, max_pieces=max_pieces, time_limit=time_limit,
+                                          common_pieces=common_pieces, fixed_pieces=fixed_pieces))
+    cache    = training.FitnessCache(cache_file, store)
+    exporter = make_metrics_exporter()
+    if exporter is not None:
+        exporter.add_cache('fitness', cache)
+    seed     = None
+    if common_pieces or fixed_pieces:
+        seed = random.randrange(2**32)
+
+    initial_population = Initalize_population(population_size)
+    population = []
+    running    = {}
+    dispatched = 0
+
+    logged     = 0
+
+    def dispatch():
+        # Next chromosome to play: random ones first, then offsprings
+        nonlocal dispatched
+        if dispatched < len(initial_population):
+            chromosome = initial_population[dispatched]
+        else:
+            elites = drop_score(choose_Best_Chromosomes(population[:], SELECTION_RATE)) or drop_score(population)
+            chromosome = Mutation(cross_over(elites)[:1])[0]
+        dispatched += 1
+
+        game_seed = seed if seed is not None else random.randrange(2**32)
+        key = training.FitnessCache.make_key(chromosome, game_seed, max_pieces, time_limit)
+        result = cache.get(key)
+        if result is not None:
+            return chromosome, result, game_seed, 0.0
+        future = pool.submit(training.timed_evaluate_chromosome, chromosome, game_seed, max_pieces, time_limit)
+        running[future] = chromosome, key
+        return None
+
+    # Only the initial chromosomes: offsprings need a population to breed from
+    finished = []
+    while dispatched < min(evaluations, len(initial_population)) and len(running) < workers:
+        cached = dispatch()
+        if cached is not None:
+            finished.append(cached)
+
+    while running or finished:
+        if not finished:
+            done, pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                chromosome, key = running.pop(future)
+                result, worker, seconds = future.result()
+                if exporter is not None:
+                    exporter.record_game(result, worker, seconds)
+                cache.put(key, result)
+                finished.append((chromosome, result, key[1], seconds))
+
+        chromosome, result, game_seed, seconds = finished.pop(0)
+        log.record(None, logged, chromosome, game_seed, result, seconds=seconds)
+        logged += 1
+        score, moves_taken, linesRemoved, censored = result
+        entry = [chromosome, score, moves_taken, censored]
+
+        if len(population) < population_size:
+            population.append(entry)
+        elif replacement == 'oldest':
+            population.pop(0)
+            population.append(entry)
+        else:
+            worst = min(range(len(population)), key=lambda i: calc_fitness(*population[i][1:]))
+            if calc_fitness(*entry[1:]) > calc_fitness(*population[worst][1:]):
+                population[worst] = entry
+
+        # Keep every worker busy
+        while dispatched < evaluations and len(running) < workers:
+            cached = dispatch()
+            if cached is not None:
+                finished.append(cached)
+
+    log.close()
+    pool.shutdown()
+    if exporter is not None:
+        exporter.close()
+    if store is not None:
+        store.close()
+    print(f"Fitness cache: {cache.hits} hits, {cache.misses} misses")
+
+    return population
+
+
+def evaluate_generation(population, currnet_evolution_number, headless=False, pool=None, race_rounds=0, max_pieces=None,
+                        time_limit=None, common_pieces=False, fixed_seeds=None, cache=None, batch=False, states=None,
+                        profiler=None, exporter=None):
+    """Yield (index, (score, moves taken, lines removed, censored), eliminated, seed, seconds) of every chromosome
+
+    Without a pool the games are played here one after another, in order;
+    with one they are played by the workers and yielded as they finish.
+    When racing (headless only), the results are the means of the games
+    played and eliminated chromosomes are yielded as soon as they drop out.
+    The piece seeds are drawn from the GA random state before any game,
+    unless fixed_seeds are given. In headless mode, games already in the
+    cache are not played again, and with batch the games are played in
+    lockstep by the NumPy batch simulator. With corpus states (headless
+    only), the chromosomes are scored on continuations of a sample of them.
+    The games played here one after another are added to the profiler, and
+    every game played to the metrics exporter. The seed is the piece seed
+    of the game, or the list of seeds of a race or of the corpus sample,
+    and seconds the wall time the evaluation took (see
+    training.evaluate_games).
+
+    """
+    if headless and states is not None:
+        sample = corpus.sample_states(states, CORPUS_SAMPLE_SIZE)
+        seeds  = [seed for state, seed in sample]
+        for i, result, seconds in training.evaluate_corpus(pool, population, sample, CORPUS_CONTINUATION):
+            yield i, result, False, seeds, seconds
+        return
+
+    if headless and race_rounds > 0:
+        seeds = fixed_seeds
+        if seeds is None:
+            seeds = [random.randrange(2**32) for i in range(race_rounds)]
+        survivors = int(len(population) * SELECTION_RATE)
+        for i, result, eliminated, seconds in training.race_population(pool, population, seeds, survivors,
+                                                                       RACE_MIN_ROUNDS, RACE_CONFIDENCE, max_pieces,
+                                                                       time_limit, cache, batch, exporter):
+            yield i, result, eliminated, seeds, seconds
+        return
+
+    if fixed_seeds is not None:
+        seeds = [fixed_seeds[0]] * len(population)
+    elif common_pieces:
+        seeds = [random.randrange(2**32)] * len(population)
+    else:
+        seeds = [random.randrange(2**32) for chromosome in population]
+
+    if not headless:
         for i in range(0 , len(population)):
-            current_chromosome = population[i]
-            score, moves_taken , linesRemoved = run_game_return_score(current_chromosome ,Evolution , i)
-            f.write(f"Chromosome {current_chromosome}\n\tscored: {score}\n\t Moves:{moves_taken}\n\t LinesRemoved:{linesRemoved}\n")
-            population[i] = [current_chromosome, score]
-        # With Score means each array consisnt of [chromosome , Score] for filteration purposes
-        best_chromosomes_With_Scores = choose_Best_Chromosomes(population, SELECTION_RATE)
-        best_chromosome = drop_score(best_chromosomes_With_Scores)
-        offSprings = cross_over(best_chromosome)
-        mutated_offsprings = Mutation(offSprings)
-        population = best_chromosome + mutated_offsprings
+            start  = time.perf_counter()
+            result = run_game_return_score(population[i], currnet_evolution_number, i, headless, max_pieces, time_limit,
+                                           seeds[i], profiler, exporter)
+            yield i, result, False, seeds[i], time.perf_counter() - start
+        return
 
+    for i, result, seconds in training.evaluate_games(pool, population, seeds, max_pieces, time_limit, cache, batch,
+                                                      profiler, exporter):
+        yield i, result, False, seeds[i], seconds
 
-    f.close()
 
+def run_game_return_score(current_chromosome , currnet_evolution_number , current_chromosome_number, headless=False,
+                          max_pieces=None, time_limit=None, seed=None, profiler=None, exporter=None):
+    if not headless:
+        def renderer(board, score, total_lines_removed, moves_taken, next_piece):
+            # Check for quit
+            check_quit()
+            level, fall_freq = calc_level_and_fall_freq(score)
 
-def run_game_return_score(current_chromosome , currnet_evolution_number , current_chromosome_number):
-    # Setup variables
-    board = get_blank_board()
-    score = 0
-    total_lines_removed = 0
-    falling_piece = get_new_piece()
-    next_piece = get_new_piece()
-    moves_taken = 0
-    while True:
-        # Game Loop
-        if (falling_piece == None):
-            # No falling piece in play, so start a new piece at the top
-            falling_piece = next_piece
-            next_piece = get_new_piece()
-            score += 1
-            if (not is_valid_position(board, falling_piece)):
-                # GAME-OVER
-                # Can't fit a new piece on the board, so game over.
-                print(f"Score is now {score}")
-                return score, moves_taken, total_lines_removed
-        # Check for quit
-        check_quit()
-        moves = GenerateAllPossibleMovesWithScores(board , falling_piece , current_chromosome)
-        if(len(moves) == 0):# IF there is no moves availabe to  play
-            print(f"Score is now {score}")
-            return score ,moves_taken , total_lines_removed
-        bestMove  = chooseBestMove(moves)
-        rotation = bestMove[0]
-        x = bestMove[1]
-        falling_piece["x"] = x
-        falling_piece["y"] = -1
-        falling_piece['rotation'] = rotation
-
-        for i in range(1, BOARDHEIGHT):
-            if (not is_valid_position(board, falling_piece, adj_Y=i)):
-                break
-        falling_piece['y'] += i - 1
-        # Falling piece has landed, set it on the board
-        add_to_board(board, falling_piece)
-        # time.sleep(6)
-        num_removed_lines = remove_complete_lines(board)
-        total_lines_removed += num_removed_lines
-        # Bonus score for complete lines at once
-        # 40   pts for 1 line
-        # 120  pts for 2 lines
-        # 300  pts for 3 lines
-        # 1200 pts for 4 lines
-
-        if(num_removed_lines == 1):
-            score += 40
-        elif (num_removed_lines == 2):
-            score += 120
-        elif (num_removed_lines == 3):
-            score += 300
-        elif (num_removed_lines == 4):
-            score += 1200
+            # Drawing everything on the screen
+            DISPLAYSURF.fill(BGCOLOR)
+            draw_board(board)
+            draw_statusGeneticMode(score, level, total_lines_removed, currnet_evolution_number, current_chromosome_number, moves_taken, current_chromosome)
+            draw_next_piece(next_piece)
+            pygame.display.update()
+            FPSCLOCK.tick(FPS)
 
-        level, fall_freq = calc_level_and_fall_freq(score)
-        falling_piece    = None
+            if exporter is not None:
+                exporter.record_placement(board, score, total_lines_removed, moves_taken)
 
+        game_profiler = None
+        if profiler is not None:
+            game_profiler = Profiler()
 
+        result = play_game(current_chromosome, renderer=renderer, max_pieces=max_pieces, time_limit=time_limit,
+                           pieces=PieceStream(seed), profiler=game_profiler)
+        if profiler is not None:
+            print(game_profiler.report(f"Game profile of chromosome # {current_chromosome_number}"))
+            profiler.merge(game_profiler)
+        if exporter is not None:
+            exporter.record_game(result)
 
-        # Drawing everything on the screen
-        DISPLAYSURF.fill(BGCOLOR)
-        draw_board(board)
-        draw_statusGeneticMode(score, level, total_lines_removed, currnet_evolution_number, current_chromosome_number, moves_taken, current_chromosome)
-        draw_next_piece(next_piece)
+        return result
 
-        if falling_piece != None:
-            draw_piece(falling_piece)
-        pygame.display.update()
-        FPSCLOCK.tick(FPS)
-        moves_taken += 1
+    result = training.evaluate_chromosome(current_chromosome, seed, max_pieces, time_limit, profiler, exporter)
+    if exporter is not None:
+        exporter.record_game(result)
+
+    return result
 
 
 ##############################################################################
@@ -1069,116 +1239,100 @@ def run_game_return_score(current_chromosome , currnet_evolution_number , curren
 ##############################################################################
 
 def RunTetrisBeastMode():
-    global FPSCLOCK, DISPLAYSURF, BASICFONT, BIGFONT
-    pygame.init()
-    FPSCLOCK = pygame.time.Clock()
-    DISPLAYSURF = pygame.display.set_mode((WINDOWWIDTH, WINDOWHEIGHT))
-    BASICFONT = pygame.font.Font('freesansbold.ttf', 18)
-    BIGFONT = pygame.font.Font('freesansbold.ttf', 100)
-    pygame.display.set_caption('Tetris AI')
-    f = open("Test score.txt", "a")
-    f.write("************************************************************************************************\n")
+    init_display()
+    log = runlog.RunLog(RESULTS_LOG_FILE)
     testing_chromosome = [-1.42 , 7 ,-8 , -2.41 , 8,6,8]
-    score, moves_taken, linesRemoved = RunGameReturnScoreBeastMode(testing_chromosome)
-    f.write(f"Chromosome {testing_chromosome}\n\tscored: {score}\n\t Moves:{moves_taken}\n\t LinesRemoved:{linesRemoved}\n")
-    f.close()
+    start  = time.perf_counter()
+    result = RunGameReturnScoreBeastMode(testing_chromosome)
+    log.record(None, 0, testing_chromosome, None, result, seconds=time.perf_counter() - start, mode='beast')
+    log.close()
 
 def RunGameReturnScoreBeastMode(current_chromosome):
-    # Setup variables
-    board = get_blank_board()
-    score = 0
-    total_lines_removed = 0
-    falling_piece = get_new_piece()
-    next_piece = get_new_piece()
-    moves_taken = 0
-    while True:
-        # Game Loop
-        if (falling_piece == None):
-            # No falling piece in play, so start a new piece at the top
-            falling_piece = next_piece
-            next_piece = get_new_piece()
-            score += 1
-            if (not is_valid_position(board, falling_piece)):
-                # GAME-OVER
-                # Can't fit a new piece on the board, so game over.
-                print(f"Score is now {score}")
-                return score, moves_taken, total_lines_removed
+    def renderer(board, score, total_lines_removed, moves_taken, next_piece):
         # Check for quit
         check_quit()
-        moves = GenerateAllPossibleMovesWithScoresBeastMode(board, copy.deepcopy(falling_piece), current_chromosome, copy.deepcopy(next_piece))
-
-        if (len(moves) == 0):  # IF there is no moves availabe to  play
-            print(f"Score is now {score}")
-            return score, moves_taken, total_lines_removed
-        best_move = chooseBestMove(moves) #[rotation , X , Score]
-        falling_piece["x"] = best_move[1]
-        falling_piece["y"] = -1
-        falling_piece['rotation'] = best_move[0]
-        for i in range(1, BOARDHEIGHT):
-            if (not is_valid_position(board, falling_piece, adj_Y=i)):
-                break
-        falling_piece['y'] += i - 1
-        # Falling piece has landed, set it on the board
-        add_to_board(board, falling_piece)
-        num_removed_lines = remove_complete_lines(board)
-        total_lines_removed += num_removed_lines
-        # Bonus score for complete lines at once
-        # 40   pts for 1 line
-        # 120  pts for 2 lines
-        # 300  pts for 3 lines
-        # 1200 pts for 4 lines
-
-        if (num_removed_lines == 1):
-            score += 40
-        elif (num_removed_lines == 2):
-            score += 120
-        elif (num_removed_lines == 3):
-            score += 300
-        elif (num_removed_lines == 4):
-            score += 1200
-
         level, fall_freq = calc_level_and_fall_freq(score)
-        falling_piece = None
+
         # Drawing everything on the screen
         DISPLAYSURF.fill(BGCOLOR)
         draw_board(board)
         draw_statusBeastMode(score, level, total_lines_removed, moves_taken,current_chromosome)
 
         draw_next_piece(next_piece)
-
-        if falling_piece != None:
-            draw_piece(falling_piece)
         pygame.display.update()
         FPSCLOCK.tick(FPS)
-        moves_taken += 1
-def GenerateAllPossibleMovesWithScoresBeastMode(board, falling_piece, current_chromosome, next_piece=None):
-    moves = []
-    for rotation in range(len(PIECES[falling_piece['shape']])):
-        for x in range(-2, 8):
-            move_info = calc_move_info(board, falling_piece, x, rotation, 0, 0)
-            next_piece_score = 0
-
-            isValidMove = move_info[0]
-            if isValidMove:
-                if next_piece is not None:
-                    new_board = copy.deepcopy(board)
-                    falling_piece["x"] = x
-                    falling_piece["rotation"] = rotation
-
-                    for i in range(1, BOARDHEIGHT):
-                        if (not is_valid_position(board, falling_piece, adj_Y=i)):
-                            break
-                    falling_piece['y'] += i - 1
-                    add_to_board(new_board, falling_piece)
-                    moves2 = GenerateAllPossibleMovesWithScoresBeastMode(new_board, next_piece, current_chromosome, None)
-                    best_move = chooseBestMove(moves2)
-                    next_piece_score += best_move[2]
-                move_score = CalculateFitnessScore(move_info, current_chromosome)
-                moves.append((rotation, x, move_score + next_piece_score))
-
-    return moves
 
+        if exporter is not None:
+            exporter.record_placement(board, score, total_lines_removed, moves_taken)
+
+    table = None
+    if TRANSPOSITION_TABLE_SIZE:
+        table = TranspositionTable(TRANSPOSITION_TABLE_SIZE)
+    profiler = None
+    if PROFILING:
+        profiler = Profiler()
+    exporter = make_metrics_exporter()
+    if exporter is not None and table is not None:
+        exporter.add_cache('transposition', table)
+
+    result = play_game(current_chromosome, beast_mode=True, renderer=renderer,
+                       search=dict(depth=SEARCH_DEPTH, beam_width=BEAM_WIDTH, time_budget=MOVE_TIME_BUDGET, table=table),
+                       profiler=profiler)
+    if table is not None:
+        print(f"Transposition table: {table.hits} hits, {table.misses} misses")
+    if profiler is not None:
+        print(profiler.report("Beast Mode game profile"))
+    if exporter is not None:
+        exporter.record_game(result)
+        exporter.close()
+
+    return result
 
 
 if __name__ == "__main__":
-    display_menu()
+    parser = argparse.ArgumentParser(description='Tetris AI')
+    parser.add_argument('--headless', action='store_true', help='run the genetic algorithm without a display')
+    parser.add_argument('--workers', type=int, default=WORKERS_NUMBER, help='processes playing games in parallel (headless only)')
+    parser.add_argument('--race', type=int, default=RACE_ROUNDS, metavar='ROUNDS', help='race chromosomes over up to ROUNDS games each (headless only)')
+    parser.add_argument('--max-pieces', type=int, default=GAME_PIECES_BUDGET, help='stop every game after this many pieces (headless only)')
+    parser.add_argument('--time-limit', type=float, default=GAME_TIME_BUDGET, help='stop every game after this many seconds (headless only)')
+    parser.add_argument('--common-pieces', action='store_true', default=COMMON_PIECE_SEQUENCES, help='all chromosomes of a generation play the same pieces (headless only)')
+    parser.add_argument('--fixed-pieces', action='store_true', default=FIXED_PIECE_SEQUENCES, help='every chromosome of every generation plays the same pieces (headless only)')
+    parser.add_argument('--fitness-cache', default=FITNESS_CACHE_FILE, metavar='FILE', help='keep game results in FILE and reuse them in later runs (headless only)')
+    parser.add_argument('--islands', type=int, default=ISLANDS_NUMBER, help='evolve this many populations in parallel processes with migration (headless only)')
+    parser.add_argument('--migration-interval', type=int, default=MIGRATION_INTERVAL, metavar='GENERATIONS', help='generations between two island migrations')
+    parser.add_argument('--steady-state', action='store_true', help='evolve without generations, breeding a new chromosome whenever a game ends (headless only)')
+    parser.add_argument('--evaluations', type=int, default=STEADY_STATE_EVALUATIONS, help='games played in steady-state mode')
+    parser.add_argument('--population-size', type=int, default=POPULATION_SIZE, help='chromosomes kept in the population in steady-state mode')
+    parser.add_argument('--replacement', choices=['worst', 'oldest'], default=STEADY_STATE_REPLACEMENT, help='chromosome replaced by a new one in steady-state mode')
+    parser.add_argument('--optimizer', choices=['ga', 'cem'], default=OPTIMIZER, help='optimizer of the generational training loop')
+    parser.add_argument('--corpus', metavar='FILE', help='score chromosomes on continuations of the board states of FILE (headless only)')
+    parser.add_argument('--collect-corpus', metavar='FILE', help='play a few games and save their board states to FILE, then exit')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, metavar='FILE', help='save the run to FILE and resume from it if it exists')
+    parser.add_argument('--profile', action='store_true', default=PROFILING, help='print the time spent in every phase of each game and generation')
+    parser.add_argument('--metrics-file', default=METRICS_FILE, metavar='FILE', help='rewrite live throughput metrics to FILE as JSON every few seconds (the game being played only without --workers)')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, metavar='PORT', help='serve live throughput metrics as JSON on localhost:PORT')
+    parser.add_argument('--store', default=STORE_FILE, metavar='FILE', help='add the run and its games to the SQLite experiment store FILE and reuse its results')
+    parser.add_argument('--batch', action='store_true', default=BATCH_EVALUATION, help='play the games of a generation together with the NumPy batch simulator (headless only)')
+    args = parser.parse_args()
+    if args.batch and args.time_limit is not None:
+        parser.error('--batch games share their time, use --max-pieces as budget')
+
+    options = dict(race_rounds=args.race, max_pieces=args.max_pieces, time_limit=args.time_limit,
+                   common_pieces=args.common_pieces, fixed_pieces=args.fixed_pieces, cache_file=args.fitness_cache,
+                   batch=args.batch, store_file=args.store)
+    PROFILING    = args.profile
+    METRICS_FILE = args.metrics_file
+    METRICS_PORT = args.metrics_port
+    if args.collect_corpus:
+        collect_corpus(args.collect_corpus)
+    elif args.headless and args.steady_state:
+        RunTetrisSteadyStateGeneticAlgorithm(args.workers, args.evaluations, args.population_size, args.replacement,
+                                             **options)
+    elif args.headless and args.islands > 1:
+        RunTetrisIslandGeneticAlgorithm(args.islands, args.migration_interval, **options)
+    elif args.headless:
+        RunTetrisGeneticAlgorithm(headless=True, workers=args.workers, optimizer=args.optimizer, corpus_file=args.corpus,
+                                  checkpoint_file=args.checkpoint, profile=args.profile, **options)
+    else:
+        display_menu()
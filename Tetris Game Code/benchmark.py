@@ -0,0 +1,241 @@
+import sys, time, json, argparse, platform
+
+import engine
+import bitboard
+import boardstate
+import corpus
+from engine import BOARDWIDTH, PIECE_TABLE, LIST_BACKEND
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Headless benchmarks of the engine hot paths and of whole games. Every
+# benchmark runs on the same fixed corpus of mid-game board states, made by
+# playing CORPUS_GAME_PIECES pieces of the seeded game CORPUS_SEED with
+# BENCHMARK_CHROMOSOME and keeping the board every CORPUS_INTERVAL pieces.
+BENCHMARK_CHROMOSOME = [-1.42 , 7 ,-8 , -2.41 , 8,6,8]
+CORPUS_SEED          = 2024
+CORPUS_GAME_PIECES   = 600
+CORPUS_INTERVAL      = 10
+
+# End-to-end games: GAME_SEEDS seeded games of at most GAME_PIECES pieces
+GAME_SEEDS  = [1, 2, 3]
+GAME_PIECES = 300
+
+# Each benchmark is repeated until it ran at least MIN_TIME seconds
+MIN_TIME = 0.5
+
+# A benchmark slower than REGRESSION_RATIO times its baseline is reported as
+# a regression, and a faster one than 1 / REGRESSION_RATIO as a speedup
+REGRESSION_RATIO = 0.9
+
+# Board backends benchmarked, by name
+BACKENDS = {'list': LIST_BACKEND, 'bitboard': bitboard, 'boardstate': boardstate}
+
+
+##############################################################################
+# CORPUS
+##############################################################################
+
+def make_corpus():
+    """Return the (rows, falling code, next code) states of the benchmark corpus"""
+
+    return corpus.collect_states(BENCHMARK_CHROMOSOME, CORPUS_SEED, CORPUS_INTERVAL, CORPUS_GAME_PIECES, verbose=False)
+
+
+def make_positions(backend, states):
+    """Return the (board, falling piece, next piece) of every corpus state for the backend"""
+
+    return [(corpus.make_board(rows, backend), engine.decode_piece(falling_code), engine.decode_piece(next_code))
+            for rows, falling_code, next_code in states]
+
+
+##############################################################################
+# BENCHMARKS
+##############################################################################
+
+# Every benchmark takes the backend and the positions, runs its hot path once
+# over the whole corpus and returns the number of calls it made.
+
+def bench_is_valid_position(backend, positions):
+    calls = 0
+    for board, piece, next_piece in positions:
+        for rotation in range(len(PIECE_TABLE[piece['shape']])):
+            piece['rotation'] = rotation
+            for x in PIECE_TABLE[piece['shape']][rotation]['x_range']:
+                piece['x'] = x
+                piece['y'] = 0
+                backend.is_valid_position(board, piece)
+                calls += 1
+
+    return calls
+
+
+def bench_calc_move_info(backend, positions):
+    calls = 0
+    for board, piece, next_piece in positions:
+        skyline = backend.get_skyline(board)
+        for rotation in range(len(PIECE_TABLE[piece['shape']])):
+            for x in PIECE_TABLE[piece['shape']][rotation]['x_range']:
+                backend.calc_move_info(board, piece, x, rotation, 0, 0, skyline)
+                calls += 1
+
+    return calls
+
+
+def bench_calc_heuristics(backend, positions):
+    for board, piece, next_piece in positions:
+        for x in range(BOARDWIDTH):
+            backend.calc_heuristics(board, x)
+
+    return len(positions) * BOARDWIDTH
+
+
+def bench_remove_complete_lines(backend, positions):
+    # Corpus boards have no complete line: this is the check done after every move
+    for board, piece, next_piece in positions:
+        backend.remove_complete_lines(board)
+
+    return len(positions)
+
+
+def bench_generate_moves(backend, positions):
+    for board, piece, next_piece in positions:
+        engine.GenerateAllPossibleMovesWithScores(board, piece, BENCHMARK_CHROMOSOME, backend)
+
+    return len(positions)
+
+
+def bench_beam_search(backend, positions):
+    for board, piece, next_piece in positions:
+        engine.beam_search(board, [piece, next_piece], BENCHMARK_CHROMOSOME, depth=2, backend=backend)
+
+    return len(positions)
+
+
+BENCHMARKS = {'is_valid_position':                  bench_is_valid_position,
+              'calc_move_info':                     bench_calc_move_info,
+              'calc_heuristics':                    bench_calc_heuristics,
+              'remove_complete_lines':              bench_remove_complete_lines,
+              'GenerateAllPossibleMovesWithScores': bench_generate_moves,
+              'beam_search':                        bench_beam_search}
+
+
+def measure(function, *args, min_time=MIN_TIME):
+    """Call function(*args) until min_time seconds passed and return its calls per second"""
+
+    calls   = 0
+    elapsed = 0
+    start   = time.perf_counter()
+    while elapsed < min_time:
+        calls  += function(*args)
+        elapsed = time.perf_counter() - start
+
+    return calls / elapsed
+
+
+def measure_games(backend, min_time=MIN_TIME):
+    """Play the benchmark games until min_time seconds passed
+
+    Returns the placements per second and the games per second of
+    BENCHMARK_CHROMOSOME.
+
+    """
+    games   = 0
+    moves   = 0
+    elapsed = 0
+    start   = time.perf_counter()
+    while elapsed < min_time:
+        for seed in GAME_SEEDS:
+            score, moves_taken, lines_removed, censored = engine.play_game(BENCHMARK_CHROMOSOME, backend=backend,
+                                                                           max_pieces=GAME_PIECES,
+                                                                           pieces=engine.PieceStream(seed),
+                                                                           verbose=False)
+            moves += moves_taken
+        games  += len(GAME_SEEDS)
+        elapsed = time.perf_counter() - start
+
+    return moves / elapsed, games / elapsed
+
+
+def run_benchmarks(backends=BACKENDS, min_time=MIN_TIME):
+    """Run every benchmark on every backend and return the results
+
+    The results map 'backend/benchmark' to calls per second (placements per
+    second and games per second for the 'game_placements' and 'game_games'
+    end-to-end benchmarks).
+
+    """
+    states  = make_corpus()
+    results = {}
+    for name in backends:
+        backend   = BACKENDS[name]
+        positions = make_positions(backend, states)
+        for benchmark in BENCHMARKS:
+            results[f'{name}/{benchmark}'] = measure(BENCHMARKS[benchmark], backend, positions, min_time=min_time)
+            print(f"{name}/{benchmark}: {results[f'{name}/{benchmark}']:.1f} calls/s")
+
+        placements, games = measure_games(backend, min_time)
+        results[f'{name}/game_placements'] = placements
+        results[f'{name}/game_games']      = games
+        print(f"{name}/game: {placements:.1f} placements/s, {games:.2f} games/s")
+
+    return results
+
+
+##############################################################################
+# RESULT FILES
+##############################################################################
+
+def save_results(path, results):
+    """Write the results to a JSON file, with the Python version and the corpus settings"""
+
+    corpus_settings = {'seed': CORPUS_SEED, 'game_pieces': CORPUS_GAME_PIECES, 'interval': CORPUS_INTERVAL}
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(), 'corpus': corpus_settings, 'results': results}, f, indent=2,
+                  sort_keys=True)
+
+
+def load_results(path):
+    """Return the results saved by save_results"""
+
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare_results(results, baseline):
+    """Print every benchmark against its baseline and return the regressed benchmarks"""
+
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            print(f"{name}: no baseline")
+            continue
+
+        ratio = results[name] / baseline[name]
+        note  = ''
+        if ratio < REGRESSION_RATIO:
+            note = '  REGRESSION'
+            regressions.append(name)
+        elif ratio > 1 / REGRESSION_RATIO:
+            note = '  speedup'
+        print(f"{name}: {ratio:.2f}x baseline{note}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Tetris engine hot paths and whole games')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS), help='board backends to benchmark')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, metavar='SECONDS', help='time every benchmark runs for')
+    parser.add_argument('--output', metavar='FILE', help='save the results to FILE as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results with those saved in FILE')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.backends, args.min_time)
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        if compare_results(results, load_results(args.baseline)):
+            sys.exit(1)
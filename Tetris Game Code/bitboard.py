@@ -0,0 +1,296 @@
+import sys
+import engine
+from engine import BOARDWIDTH, BOARDHEIGHT, BLANK, PIECE_TABLE
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Bitboard board backend: the board is a list of BOARDHEIGHT integers, one per
+# row (top row first), where bit x is set when column x is filled. Collision is
+# a mask AND, a complete line is an equality check against FULL_ROW and
+# clearing lines is a list slice. It exposes the same functions as the engine
+# list board, so it can be passed as `backend` to the move generators and
+# play_game.
+
+FULL_ROW    = (1 << BOARDWIDTH) - 1
+WALLS_MASK  = 1 | (1 << (BOARDWIDTH - 1))
+
+# This module, as passed to the engine functions taking a backend
+BITBOARD_BACKEND = sys.modules[__name__]
+
+# Per shape and rotation: for every legal x, the list of (template row, row
+# mask already shifted to x). Built once at import from engine.PIECE_TABLE.
+PIECE_MASKS = {}
+
+for shape in PIECE_TABLE:
+    PIECE_MASKS[shape] = []
+    for geometry in PIECE_TABLE[shape]:
+        masks_by_x = {}
+        for x in geometry['x_range']:
+            masks = {}
+            for Px, Py in geometry['cells']:
+                masks[Py] = masks.get(Py, 0) | 1 << (Px + x)
+            masks_by_x[x] = sorted(masks.items())
+        PIECE_MASKS[shape].append(masks_by_x)
+
+
+##############################################################################
+# BOARD FUNCTIONS
+##############################################################################
+
+def get_blank_board():
+    """Create and return a new blank bitboard"""
+
+    return [0] * BOARDHEIGHT
+
+
+def from_board(board):
+    """Convert an engine list board (board[x][y]) to a bitboard"""
+
+    rows = get_blank_board()
+    for x in range(BOARDWIDTH):
+        for y in range(BOARDHEIGHT):
+            if board[x][y] != BLANK:
+                rows[y] |= 1 << x
+
+    return rows
+
+
+def to_board(rows, color=0):
+    """Convert a bitboard to an engine list board, e.g. to draw it"""
+
+    board = engine.get_blank_board()
+    for y in range(BOARDHEIGHT):
+        for x in range(BOARDWIDTH):
+            if rows[y] >> x & 1:
+                board[x][y] = color
+
+    return board
+
+
+def get_board_key(rows):
+    """Return a hashable key of the board cells (see engine.get_board_key)"""
+
+    return tuple(rows)
+
+
+def get_skyline(rows):
+    """Return the top filled row of every column (BOARDHEIGHT if it is empty)"""
+
+    skyline = [BOARDHEIGHT] * BOARDWIDTH
+    seen    = 0
+    for y in range(BOARDHEIGHT):
+        # Columns whose first block is on this row
+        new = rows[y] & ~seen
+        while new:
+            low  = new & -new
+            skyline[low.bit_length() - 1] = y
+            new ^= low
+
+        seen |= rows[y]
+        if seen == FULL_ROW:
+            break
+
+    return skyline
+
+
+def is_valid_position(rows, piece, adj_X=0, adj_Y=0):
+    """Return True if the piece is within the board and not colliding"""
+
+    masks = PIECE_MASKS[piece['shape']][piece['rotation']].get(piece['x'] + adj_X)
+    if masks is None:
+        return False
+
+    top = piece['y'] + adj_Y
+    for y, mask in masks:
+        y += top
+        if y < 0:
+            continue
+        if y >= BOARDHEIGHT or rows[y] & mask:
+            return False
+
+    return True
+
+
+def add_to_board(rows, piece):
+    """Fill in the board based on piece's location, shape, and rotation"""
+
+    for y, mask in PIECE_MASKS[piece['shape']][piece['rotation']][piece['x']]:
+        rows[y + piece['y']] |= mask
+
+
+def is_complete_line(rows, y):
+    """Return True if the line filled with boxes with no gaps"""
+
+    return rows[y] == FULL_ROW
+
+
+def remove_complete_lines(rows, removed_rows=None):
+    """Remove any completed lines on the board.
+
+    Keep the incomplete rows in order, pad the top with blank rows and
+    return the number of complete lines. If a removed_rows list is given,
+    the y of every removed line is appended to it, top-most first.
+
+    """
+    kept = [row for row in rows if row != FULL_ROW]
+    num_removed_lines = BOARDHEIGHT - len(kept)
+    if num_removed_lines:
+        if removed_rows is not None:
+            removed_rows.extend(y for y in range(BOARDHEIGHT) if rows[y] == FULL_ROW)
+        rows[:] = [0] * num_removed_lines + kept
+
+    return num_removed_lines
+
+
+def apply_move(rows, piece, remove_lines=True):
+    """Add the piece to the board in place and remove the complete lines
+
+    Returns the number of removed lines and an undo log for undo_move (see
+    engine.apply_move).
+
+    """
+    add_to_board(rows, piece)
+
+    removed_rows = []
+    if remove_lines:
+        remove_complete_lines(rows, removed_rows)
+
+    return len(removed_rows), (piece['shape'], piece['rotation'], piece['x'], piece['y'], removed_rows)
+
+
+def undo_move(rows, undo):
+    """Roll back a move done with apply_move"""
+
+    shape, rotation, x, y, removed_rows = undo
+
+    # Put the full rows back where they were and drop the blank padding
+    if removed_rows:
+        kept = rows[len(removed_rows):]
+        for removed_y in removed_rows:
+            kept.insert(removed_y, FULL_ROW)
+        rows[:] = kept
+
+    for Py, mask in PIECE_MASKS[shape][rotation][x]:
+        rows[Py + y] &= ~mask
+
+
+##############################################################################
+# GAME STATISTICS FUNCTIONS
+##############################################################################
+
+def calc_move_info(rows, piece, x, r, total_holes_bef, total_blocking_bloks_bef, skyline=None):
+    """Calculate informations based on the current play (see engine.calc_move_info)"""
+
+    piece['rotation'] = r
+    piece['y']        = 0
+    piece['x']        = x
+
+    # Check if it's a valid position
+    if (not is_valid_position(rows, piece)):
+        return [False]
+
+    # Goes down the piece to where it lands
+    if skyline is None:
+        skyline = get_skyline(rows)
+    engine.drop_piece(rows, piece, skyline, BITBOARD_BACKEND)
+
+    # Calculate the sides in contact
+    piece_sides, floor_sides, wall_sides = calc_sides_in_contact(rows, piece)
+
+    # Play the move on the board itself and calculate removed lines; the
+    # board is rolled back once the heuristics are known
+    num_removed_lines, undo = apply_move(rows, piece)
+    total_holes, total_blocking_block, max_height = calc_board_heuristics(rows)
+    undo_move(rows, undo)
+
+    new_holes           = total_holes - total_holes_bef
+    new_blocking_blocks = total_blocking_block - total_blocking_bloks_bef
+
+    return [True, max_height, num_removed_lines, new_holes, new_blocking_blocks, piece_sides, floor_sides, wall_sides]
+
+
+def calc_initial_move_info(rows):
+    total_holes, total_blocking_bocks, sum_heights = calc_board_heuristics(rows)
+
+    return total_holes, total_blocking_bocks
+
+
+def calc_board_heuristics(rows):
+    """Calculate the heuristics of all columns at once
+
+    Same values as summing engine.calc_heuristics over every column: number
+    of holes, number of blocks above a hole and summed heights.
+
+    """
+    total_holes        = 0
+    blocks_above_holes = 0
+    sum_heights        = 0
+
+    # Top-down: an empty cell is a hole if any cell above it is filled
+    covered = 0
+    for y in range(BOARDHEIGHT):
+        row = rows[y]
+        total_holes += (covered & ~row).bit_count()
+        covered     |= row
+        sum_heights += row.bit_count() * (BOARDHEIGHT - y)
+
+    # Bottom-up: a block is above a hole if any cell below it is empty
+    empty_below = 0
+    for y in range(BOARDHEIGHT - 1, -1, -1):
+        row = rows[y]
+        blocks_above_holes += (row & empty_below).bit_count()
+        empty_below        |= ~row & FULL_ROW
+
+    return total_holes, blocks_above_holes, sum_heights
+
+
+def calc_heuristics(rows, x):
+    """Calculate heuristics of column x (see engine.calc_heuristics)"""
+
+    total_holes        = 0
+    locals_holes       = 0
+    blocks_above_holes = 0
+    sum_heights        = 0
+
+    for y in range(BOARDHEIGHT-1, -1,-1):
+        if not rows[y] >> x & 1:
+            locals_holes += 1
+        else:
+            sum_heights += BOARDHEIGHT-y
+
+            if locals_holes > 0:
+                total_holes += locals_holes
+                locals_holes = 0
+
+            if total_holes > 0:
+                blocks_above_holes += 1
+
+    return total_holes, blocks_above_holes, sum_heights
+
+
+def calc_sides_in_contact(rows, piece):
+    """Calculate sides in contacts
+
+    Mask version of engine.calc_sides_in_contact: board blocks directly below
+    or beside a piece block count as piece sides.
+
+    """
+    piece_sides = 0
+    floor_sides = 0
+    wall_sides  = 0
+
+    for y, mask in PIECE_MASKS[piece['shape']][piece['rotation']][piece['x']]:
+        y += piece['y']
+        wall_sides += (mask & WALLS_MASK).bit_count()
+
+        if y == BOARDHEIGHT - 1:
+            floor_sides += mask.bit_count()
+        else:
+            piece_sides += (rows[y + 1] & mask).bit_count()
+
+        if y >= 0:
+            piece_sides += (rows[y] & (mask << 1 | mask >> 1)).bit_count()
+
+    return piece_sides, floor_sides, wall_sides
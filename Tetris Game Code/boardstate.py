@@ -0,0 +1,430 @@
+import sys
+import engine
+from engine import BOARDWIDTH, BOARDHEIGHT, BLANK, PIECE_TABLE
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Incremental board backend: the board is a BoardState, which keeps every
+# column as a bit mask (bit y set when row y is filled) together with the
+# column features used by the heuristics (top, holes, blocks above holes and
+# summed heights). Placing a piece only updates the columns it touches and a
+# line clear costs time proportional to the rows cleared, so calc_move_info
+# evaluates a candidate in about O(piece size) instead of rescanning the
+# board. It exposes the same functions as the engine list board, so it can be
+# passed as `backend` to the move generators and play_game.
+
+FULL_COLUMN = (1 << BOARDHEIGHT) - 1
+
+# This module, as passed to the engine functions taking a backend
+BOARDSTATE_BACKEND = sys.modules[__name__]
+
+
+def calc_column_features(column):
+    """Return top, holes and blocks above holes of a column bit mask
+
+    Same holes and blocks above holes as engine.calc_heuristics: a hole is an
+    empty cell with a block above it, and a block is above a hole if any cell
+    below it is empty.
+
+    """
+    if not column:
+        return BOARDHEIGHT, 0, 0
+
+    top   = (column & -column).bit_length() - 1
+    holes = BOARDHEIGHT - top - column.bit_count()
+    if not holes:
+        return top, 0, 0
+
+    # Every block above the deepest hole is a blocking block
+    deepest = (~column & FULL_COLUMN & ~((1 << (top + 1)) - 1)).bit_length() - 1
+    blocking = (column & ((1 << deepest) - 1)).bit_count()
+
+    return top, holes, blocking
+
+
+def calc_column_heights(column):
+    """Return the summed heights (BOARDHEIGHT - y) of the blocks of a column"""
+
+    sum_heights = 0
+    while column:
+        low = column & -column
+        sum_heights += BOARDHEIGHT - (low.bit_length() - 1)
+        column ^= low
+
+    return sum_heights
+
+
+def remove_row(column, y):
+    """Remove row y from a column bit mask and pull the blocks above it down"""
+
+    return (column & ~((1 << (y + 1)) - 1)) | ((column & ((1 << y) - 1)) << 1)
+
+
+class BoardState:
+    """Board plus its column features, kept up to date incrementally
+
+    cols[x] is column x as a bit mask, row_counts[y] the number of blocks on
+    row y, and tops, holes, blocking and heights the features of every column
+    with their sums in total_holes, total_blocking and total_heights.
+
+    """
+
+    def __init__(self):
+        self.cols           = [0] * BOARDWIDTH
+        self.row_counts     = [0] * BOARDHEIGHT
+        self.tops           = [BOARDHEIGHT] * BOARDWIDTH
+        self.holes          = [0] * BOARDWIDTH
+        self.blocking       = [0] * BOARDWIDTH
+        self.heights        = [0] * BOARDWIDTH
+        self.total_holes    = 0
+        self.total_blocking = 0
+        self.total_heights  = 0
+        self.full_rows      = []
+
+    def copy(self):
+        """Return an independent copy of the board state"""
+
+        state = BoardState.__new__(BoardState)
+        state.cols           = self.cols[:]
+        state.row_counts     = self.row_counts[:]
+        state.tops           = self.tops[:]
+        state.holes          = self.holes[:]
+        state.blocking       = self.blocking[:]
+        state.heights        = self.heights[:]
+        state.total_holes    = self.total_holes
+        state.total_blocking = self.total_blocking
+        state.total_heights  = self.total_heights
+        state.full_rows      = self.full_rows[:]
+
+        return state
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def is_filled(self, x, y):
+        return self.cols[x] >> y & 1
+
+    def update_column(self, x):
+        """Recalculate the features of column x and the totals"""
+
+        top, holes, blocking = calc_column_features(self.cols[x])
+        self.total_holes    += holes - self.holes[x]
+        self.total_blocking += blocking - self.blocking[x]
+        self.tops[x]         = top
+        self.holes[x]        = holes
+        self.blocking[x]     = blocking
+
+    def add_piece(self, piece):
+        """Add the piece blocks, updating only the columns it touches"""
+
+        touched = set()
+        for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+            x += piece['x']
+            y += piece['y']
+            self.cols[x]       |= 1 << y
+            self.heights[x]    += BOARDHEIGHT - y
+            self.total_heights += BOARDHEIGHT - y
+            self.row_counts[y] += 1
+            if self.row_counts[y] == BOARDWIDTH:
+                self.full_rows.append(y)
+            touched.add(x)
+
+        for x in touched:
+            self.update_column(x)
+
+    def remove_complete_lines(self):
+        """Remove the complete lines and return how many were removed"""
+
+        if not self.full_rows:
+            return 0
+
+        # Top-most row first, so the rows still to remove keep their index
+        num_removed_lines = len(self.full_rows)
+        for y in sorted(self.full_rows):
+            for x in range(BOARDWIDTH):
+                column = self.cols[x]
+                # The removed block and every block above it lose one height
+                lost = BOARDHEIGHT - y + (column & ((1 << y) - 1)).bit_count()
+                self.heights[x]    -= lost
+                self.total_heights -= lost
+                self.cols[x]        = remove_row(column, y)
+
+            del self.row_counts[y]
+            self.row_counts.insert(0, 0)
+
+        self.full_rows = []
+        for x in range(BOARDWIDTH):
+            self.update_column(x)
+
+        return num_removed_lines
+
+    def apply_move(self, piece, remove_lines=True):
+        """Add the piece and remove the complete lines, returning the lines and an undo log
+
+        The log holds the previous values of the touched columns and rows and,
+        only when lines are removed, the board as it was before removing them.
+
+        """
+        columns = []
+        rows    = []
+        for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+            x += piece['x']
+            y += piece['y']
+            columns.append((x, self.cols[x], self.tops[x], self.holes[x], self.blocking[x], self.heights[x]))
+            rows.append((y, self.row_counts[y]))
+        totals       = (self.total_holes, self.total_blocking, self.total_heights, self.full_rows[:])
+        before_clear = None
+
+        self.add_piece(piece)
+
+        num_removed_lines = 0
+        if remove_lines and self.full_rows:
+            before_clear = self.copy()
+            num_removed_lines = self.remove_complete_lines()
+
+        return num_removed_lines, (columns, rows, totals, before_clear)
+
+    def undo_move(self, undo):
+        """Roll back a move done with apply_move"""
+
+        columns, rows, totals, before_clear = undo
+        if before_clear is not None:
+            self.__dict__.update(before_clear.__dict__)
+
+        # Reversed, so a column or row touched twice gets its oldest value
+        for x, column, top, holes, blocking, heights in reversed(columns):
+            self.cols[x]     = column
+            self.tops[x]     = top
+            self.holes[x]    = holes
+            self.blocking[x] = blocking
+            self.heights[x]  = heights
+        for y, count in reversed(rows):
+            self.row_counts[y] = count
+        self.total_holes, self.total_blocking, self.total_heights, self.full_rows = totals
+
+    def calc_placement_features(self, piece):
+        """Return removed lines, holes, blocking blocks and summed heights
+
+        The features of the board as it would be after adding the piece and
+        removing complete lines, without changing this board.
+
+        """
+        new_cols    = {}
+        new_rows    = {}
+        sum_heights = self.total_heights
+        for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+            x += piece['x']
+            y += piece['y']
+            new_cols[x]  = new_cols.get(x, self.cols[x]) | 1 << y
+            new_rows[y]  = new_rows.get(y, self.row_counts[y]) + 1
+            sum_heights += BOARDHEIGHT - y
+
+        full_rows = self.full_rows + [y for y in new_rows if new_rows[y] == BOARDWIDTH]
+
+        if not full_rows:
+            # Only the touched columns change
+            total_holes    = self.total_holes
+            total_blocking = self.total_blocking
+            for x in new_cols:
+                top, holes, blocking = calc_column_features(new_cols[x])
+                total_holes    += holes - self.holes[x]
+                total_blocking += blocking - self.blocking[x]
+
+            return 0, total_holes, total_blocking, sum_heights
+
+        total_holes    = 0
+        total_blocking = 0
+        sum_heights    = 0
+        for x in range(BOARDWIDTH):
+            column = new_cols.get(x, self.cols[x])
+            for y in sorted(full_rows):
+                column = remove_row(column, y)
+
+            top, holes, blocking = calc_column_features(column)
+            total_holes    += holes
+            total_blocking += blocking
+            sum_heights    += calc_column_heights(column)
+
+        return len(full_rows), total_holes, total_blocking, sum_heights
+
+
+##############################################################################
+# BOARD FUNCTIONS
+##############################################################################
+
+def get_blank_board():
+    """Create and return a new blank board state"""
+
+    return BoardState()
+
+
+def from_board(board):
+    """Convert an engine list board (board[x][y]) to a board state"""
+
+    state = BoardState()
+    for x in range(BOARDWIDTH):
+        for y in range(BOARDHEIGHT):
+            if board[x][y] != BLANK:
+                state.cols[x]       |= 1 << y
+                state.row_counts[y] += 1
+
+        state.heights[x]     = calc_column_heights(state.cols[x])
+        state.total_heights += state.heights[x]
+        state.update_column(x)
+
+    state.full_rows = [y for y in range(BOARDHEIGHT) if state.row_counts[y] == BOARDWIDTH]
+
+    return state
+
+
+def to_board(state, color=0):
+    """Convert a board state to an engine list board, e.g. to draw it"""
+
+    board = engine.get_blank_board()
+    for x in range(BOARDWIDTH):
+        for y in range(BOARDHEIGHT):
+            if state.is_filled(x, y):
+                board[x][y] = color
+
+    return board
+
+
+def get_board_key(state):
+    """Return a hashable key of the board cells (see engine.get_board_key)"""
+
+    return tuple(state.cols)
+
+
+def get_skyline(state):
+    """Return the top filled row of every column (BOARDHEIGHT if it is empty)"""
+
+    return state.tops[:]
+
+
+def is_valid_position(state, piece, adj_X=0, adj_Y=0):
+    """Return True if the piece is within the board and not colliding"""
+
+    for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+        x += piece['x'] + adj_X
+        y += piece['y'] + adj_Y
+        if y < 0:
+            # Above the board
+            continue
+
+        if not engine.is_on_board(x, y):
+            return False
+
+        if state.cols[x] >> y & 1:
+            return False
+
+    return True
+
+
+def add_to_board(state, piece):
+    """Fill in the board based on piece's location, shape, and rotation"""
+
+    state.add_piece(piece)
+
+
+def is_complete_line(state, y):
+    """Return True if the line filled with boxes with no gaps"""
+
+    return state.row_counts[y] == BOARDWIDTH
+
+
+def remove_complete_lines(state):
+    """Remove any completed lines on the board and return how many"""
+
+    return state.remove_complete_lines()
+
+
+def apply_move(state, piece, remove_lines=True):
+    """Add the piece to the board in place and remove the complete lines
+
+    Returns the number of removed lines and an undo log for undo_move (see
+    engine.apply_move).
+
+    """
+    return state.apply_move(piece, remove_lines)
+
+
+def undo_move(state, undo):
+    """Roll back a move done with apply_move"""
+
+    state.undo_move(undo)
+
+
+##############################################################################
+# GAME STATISTICS FUNCTIONS
+##############################################################################
+
+def calc_move_info(state, piece, x, r, total_holes_bef, total_blocking_bloks_bef, skyline=None):
+    """Calculate informations based on the current play (see engine.calc_move_info)"""
+
+    piece['rotation'] = r
+    piece['y']        = 0
+    piece['x']        = x
+
+    # Check if it's a valid position
+    if (not is_valid_position(state, piece)):
+        return [False]
+
+    # Goes down the piece to where it lands
+    if skyline is None:
+        skyline = state.tops
+    engine.drop_piece(state, piece, skyline, BOARDSTATE_BACKEND)
+
+    # Calculate the sides in contact
+    piece_sides, floor_sides, wall_sides = calc_sides_in_contact(state, piece)
+
+    # Features of the hypothetical board, from the touched columns only
+    num_removed_lines, total_holes, total_blocking_block, max_height = state.calc_placement_features(piece)
+
+    new_holes           = total_holes - total_holes_bef
+    new_blocking_blocks = total_blocking_block - total_blocking_bloks_bef
+
+    return [True, max_height, num_removed_lines, new_holes, new_blocking_blocks, piece_sides, floor_sides, wall_sides]
+
+
+def calc_initial_move_info(state):
+    return state.total_holes, state.total_blocking
+
+
+def calc_heuristics(state, x):
+    """Calculate heuristics of column x (see engine.calc_heuristics)"""
+
+    return state.holes[x], state.blocking[x], state.heights[x]
+
+
+def calc_sides_in_contact(state, piece):
+    """Calculate sides in contacts (see engine.calc_sides_in_contact)"""
+
+    piece_sides = 0
+    floor_sides = 0
+    wall_sides  = 0
+
+    cols = state.cols
+    for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+        x += piece['x']
+        y += piece['y']
+
+        # Wall
+        if x == 0 or x == BOARDWIDTH-1:
+            wall_sides += 1
+
+        # Floor, or other pieces below
+        if y == BOARDHEIGHT-1:
+            floor_sides += 1
+        elif cols[x] >> (y+1) & 1:
+            piece_sides += 1
+
+        # Other pieces on the sides
+        if x > 0 and cols[x-1] >> y & 1:
+            piece_sides += 1
+
+        if x < BOARDWIDTH-1 and cols[x+1] >> y & 1:
+            piece_sides += 1
+
+    return  piece_sides, floor_sides, wall_sides
@@ -0,0 +1,128 @@
+import sys, random
+from array import array
+
+import engine
+import bitboard
+from engine import BOARDHEIGHT, LIST_BACKEND
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Corpus of mid-game board states. Instead of playing whole games, whose
+# early boards are easy for almost every chromosome, a chromosome can be
+# scored on short continuations of saved states.
+#
+# A state is the board as BOARDHEIGHT row masks (bit x set when column x is
+# filled, as in bitboard.py) plus the codes of the falling and next pieces
+# (see engine.decode_piece). On disk a state is STATE_SIZE unsigned 16-bit
+# little-endian values: the rows, then falling code << 8 | next code.
+STATE_SIZE = BOARDHEIGHT + 1
+
+
+##############################################################################
+# CORPUS FILES
+##############################################################################
+
+def save_states(path, states):
+    """Write (rows, falling code, next code) states to a corpus file"""
+
+    values = array('H')
+    for rows, falling_code, next_code in states:
+        values.extend(rows)
+        values.append(falling_code << 8 | next_code)
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    with open(path, 'wb') as f:
+        values.tofile(f)
+
+
+def load_states(path):
+    """Read the (rows, falling code, next code) states of a corpus file"""
+
+    values = array('H')
+    with open(path, 'rb') as f:
+        values.frombytes(f.read())
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    states = []
+    for start in range(0, len(values), STATE_SIZE):
+        rows  = list(values[start:start + BOARDHEIGHT])
+        codes = values[start + BOARDHEIGHT]
+        states.append((rows, codes >> 8, codes & 0xFF))
+
+    return states
+
+
+##############################################################################
+# COLLECTING STATES
+##############################################################################
+
+def collect_states(chromosome, seed, interval, max_pieces, verbose=True):
+    """Play one headless game and return its state every interval pieces
+
+    The game is stopped after max_pieces pieces, so strong chromosomes can
+    be used too. verbose prints its final score.
+
+    """
+    pieces = engine.PieceStream(seed)
+    states = []
+
+    def renderer(board, score, total_lines_removed, moves_taken, next_piece):
+        # After move k, the falling piece is piece k + 1 of the stream
+        if (moves_taken + 1) % interval == 0:
+            states.append((bitboard.from_board(board), pieces.get_code(moves_taken + 1),
+                           pieces.get_code(moves_taken + 2)))
+
+    engine.play_game(chromosome, renderer=renderer, max_pieces=max_pieces, pieces=pieces, verbose=verbose)
+
+    return states
+
+
+##############################################################################
+# CORPUS FITNESS
+##############################################################################
+
+def make_board(rows, backend=LIST_BACKEND):
+    """Return the board of a state for the backend"""
+
+    board = bitboard.to_board(rows)
+    if backend is not LIST_BACKEND:
+        board = backend.from_board(board)
+
+    return board
+
+
+def sample_states(states, count, rng=random):
+    """Pick count states (all of them if there are fewer), with a continuation seed each"""
+
+    sample = rng.sample(states, min(count, len(states)))
+    return [(state, rng.randrange(2**32)) for state in sample]
+
+
+def evaluate_on_states(chromosome, sample, length, backend=LIST_BACKEND):
+    """Score a chromosome on continuations of the sampled states
+
+    From every (state, seed) of the sample, plays at most length pieces with
+    engine.play_game: first the falling and next pieces of the state, then
+    the pieces of the seed. Returns the summed (score, moves taken, lines
+    removed) and censored, which is True when every continuation lasted the
+    whole length (no top out).
+
+    """
+    total_score    = 0
+    total_moves    = 0
+    total_lines    = 0
+    all_survived   = True
+    for (rows, falling_code, next_code), seed in sample:
+        pieces = engine.PieceStream(seed, first=bytes([falling_code, next_code]))
+        score, moves_taken, lines_removed, censored = engine.play_game(chromosome, backend=backend, max_pieces=length,
+                                                                       pieces=pieces, board=make_board(rows, backend))
+        total_score  += score
+        total_moves  += moves_taken
+        total_lines  += lines_removed
+        all_survived &= censored
+
+    return total_score, total_moves, total_lines, all_survived
@@ -0,0 +1,1067 @@
+import random, sys, time, heapq
+from collections import OrderedDict
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Headless game engine: everything needed to simulate a game (board, piece
+# spawn, placement, line clear, move scoring) with no pygame or tkinter
+# dependency, so the genetic algorithm can evaluate chromosomes at full CPU
+# speed and only optionally attach a renderer.
+
+# Board config
+BOARDWIDTH   = 10
+BOARDHEIGHT  = 25
+BLANK        = '.'
+
+# Number of piece colors (Main.COLORS must have this many entries)
+COLOR_COUNT  = 4
+
+# Board backends
+# A backend is a module providing get_blank_board, to_board, get_board_key,
+# get_skyline, is_valid_position, add_to_board, remove_complete_lines,
+# apply_move, undo_move and calc_move_info for its own board representation. This module is the list board backend
+# (board[x][y]); see bitboard.py for the integer row mask one.
+LIST_BACKEND = sys.modules[__name__]
+
+# Piece Templates
+# The TEMPLATEWIDTH and TEMPLATEHEIGHT constants simply set how large each row
+# and column for each shape’s rotation should be
+TEMPLATEWIDTH  = 5
+TEMPLATEHEIGHT = 5
+
+S_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '..OO.',
+                     '.OO..',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..OO.',
+                     '...O.',
+                     '.....']]
+
+Z_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '.OO..',
+                     '..OO.',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '.OO..',
+                     '.O...',
+                     '.....']]
+
+I_SHAPE_TEMPLATE = [['..O..',
+                     '..O..',
+                     '..O..',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     'OOOO.',
+                     '.....',
+                     '.....']]
+
+O_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '.OO..',
+                     '.OO..',
+                     '.....']]
+
+J_SHAPE_TEMPLATE = [['.....',
+                     '.O...',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..OO.',
+                     '..O..',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '...O.',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..O..',
+                     '.OO..',
+                     '.....']]
+
+L_SHAPE_TEMPLATE = [['.....',
+                     '...O.',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..O..',
+                     '..OO.',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '.O...',
+                     '.....'],
+                    ['.....',
+                     '.OO..',
+                     '..O..',
+                     '..O..',
+                     '.....']]
+
+T_SHAPE_TEMPLATE = [['.....',
+                     '..O..',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..OO.',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '.OO..',
+                     '..O..',
+                     '.....']]
+
+PIECES = {
+        'S': S_SHAPE_TEMPLATE,
+          'Z': Z_SHAPE_TEMPLATE,
+          'J': J_SHAPE_TEMPLATE,
+          'L': L_SHAPE_TEMPLATE,
+          'I': I_SHAPE_TEMPLATE,
+          'O': O_SHAPE_TEMPLATE,
+          'T': T_SHAPE_TEMPLATE
+          }
+
+
+def compile_template(template):
+    """Compile a 5x5 string template into its piece geometry
+
+    Returns a dict with the filled cells as (x, y) template offsets, the
+    bounding box, the bottom profile (lowest filled y of every occupied
+    column, as (x, y) pairs) and the range of legal board x positions.
+
+    """
+    cells = []
+    for y in range(TEMPLATEHEIGHT):
+        for x in range(TEMPLATEWIDTH):
+            if template[y][x] != BLANK:
+                cells.append((x, y))
+
+    min_x = min(x for x, y in cells)
+    max_x = max(x for x, y in cells)
+    min_y = min(y for x, y in cells)
+    max_y = max(y for x, y in cells)
+
+    bottom = []
+    for x in range(min_x, max_x + 1):
+        bottom.append((x, max(Py for Px, Py in cells if Px == x)))
+
+    return {'cells': tuple(cells),
+            'min_x': min_x,
+            'max_x': max_x,
+            'min_y': min_y,
+            'max_y': max_y,
+            'bottom': tuple(bottom),
+            'x_range': range(-min_x, BOARDWIDTH - max_x)}
+
+
+# Compiled piece table
+# PIECE_TABLE[shape][rotation] holds the geometry of every template, built once
+# at import so the hot functions look up the 4 filled cells instead of
+# scanning all 25 template characters.
+PIECE_TABLE = {}
+for shape in PIECES:
+    PIECE_TABLE[shape] = [compile_template(template) for template in PIECES[shape]]
+
+# Piece sequences
+# A piece is stored as one byte: shape index << 4 | rotation << 2 | color.
+# Sequences are generated PIECE_CHUNK_SIZE pieces at a time.
+SHAPES           = list(PIECES.keys())
+PIECE_CHUNK_SIZE = 256
+
+
+
+##############################################################################
+# BOARD FUNCTIONS
+##############################################################################
+
+def get_new_piece():
+    """Return a random new piece in a random rotation and color"""
+
+    shape= random.choice(list(PIECES.keys()))
+
+    new_piece = {'shape': shape,
+                'rotation': random.randint(0, len(PIECES[shape]) - 1),
+                'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
+                'y': -2, # start it above the board (i.e. less than 0)
+                'color': random.randint(0, COLOR_COUNT-1)}
+
+    return new_piece
+
+
+def add_to_board(board, piece):
+    """Fill in the board based on piece's location, shape, and rotation"""
+
+    for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+        board[x + piece['x']][y + piece['y']] = piece['color']
+
+
+def get_blank_board():
+    """Create and return a new blank board data structure"""
+
+    board = []
+    for i in range(BOARDWIDTH):
+        board.append([BLANK] * BOARDHEIGHT)
+
+    return board
+
+
+def to_board(board):
+    """Return the board as a list board (board[x][y]), e.g. to draw it
+
+    Every board backend provides this; the list board already is one.
+
+    """
+    return board
+
+
+def get_board_key(board):
+    """Return a hashable key of the board cells (the columns as row bit masks)
+
+    Equal boards get equal keys, colors left aside. Keys of different
+    backends are not comparable.
+
+    """
+    key = []
+    for x in range(BOARDWIDTH):
+        column = 0
+        for y in range(BOARDHEIGHT):
+            if board[x][y] != BLANK:
+                column |= 1 << y
+        key.append(column)
+
+    return tuple(key)
+
+
+def get_skyline(board):
+    """Return the top filled row of every column (BOARDHEIGHT if it is empty)"""
+
+    skyline = []
+    for x in range(BOARDWIDTH):
+        column = board[x]
+        y = 0
+        while y < BOARDHEIGHT and column[y] == BLANK:
+            y += 1
+        skyline.append(y)
+
+    return skyline
+
+
+def is_on_board(x, y):
+    """Check if the piece is on the board"""
+
+    return x >= 0 and x < BOARDWIDTH and y < BOARDHEIGHT
+
+
+def is_valid_position(board, piece, adj_X=0, adj_Y=0):
+    """Return True if the piece is within the board and not colliding"""
+    for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+        x += piece['x'] + adj_X
+        y += piece['y'] + adj_Y
+        if y < 0:
+            # Above the board
+            continue
+
+        if not is_on_board(x, y):
+            return False
+
+        if board[x][y] != BLANK:
+            return False
+
+    return True
+
+
+def is_complete_line(board, y):
+    """Return True if the line filled with boxes with no gaps"""
+
+    for x in range(BOARDWIDTH):
+        if board[x][y] == BLANK:
+            return False
+
+    return True
+
+
+def remove_complete_lines(board, removed_rows=None):
+    """Remove any completed lines on the board.
+
+    After remove any completed lines, move everything above them dowm and
+    return the number of complete lines. If a removed_rows list is given,
+    (y, row colors) of every removed line is appended to it, in order.
+
+    """
+    num_removed_lines = 0
+    y = BOARDHEIGHT - 1     # Start y at the bottom of the board
+
+    while y >= 0:
+        if is_complete_line(board, y):
+            if removed_rows is not None:
+                removed_rows.append((y, [board[x][y] for x in range(BOARDWIDTH)]))
+
+            # Remove the line and pull boxes down by one line.
+            for pullDownY in range(y, 0, -1):
+                for x in range(BOARDWIDTH):
+                    board[x][pullDownY] = board[x][pullDownY-1]
+
+            # Set very top line to blank.
+            for x in range(BOARDWIDTH):
+                board[x][0] = BLANK
+
+            num_removed_lines += 1
+
+            # Note on the next iteration of the loop, y is the same.
+            # This is so that if the line that was pulled down is also
+            # complete, it will be removed.
+        else:
+            y -= 1  # Move on to check next row up
+
+    return num_removed_lines
+
+
+def apply_move(board, piece, remove_lines=True):
+    """Add the piece to the board in place and remove the complete lines
+
+    Returns the number of removed lines and an undo log (the cells filled by
+    the piece and the removed rows) that undo_move uses to roll the board
+    back, so moves can be tried on a single board without copying it.
+
+    """
+    cells = [(x + piece['x'], y + piece['y']) for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']]
+    for x, y in cells:
+        board[x][y] = piece['color']
+
+    removed_rows = []
+    if remove_lines:
+        remove_complete_lines(board, removed_rows)
+
+    return len(removed_rows), (cells, removed_rows)
+
+
+def undo_move(board, undo):
+    """Roll back a move done with apply_move"""
+
+    cells, removed_rows = undo
+
+    # Put the removed rows back, last removed first, pushing the rows above up
+    for y, row in reversed(removed_rows):
+        for x in range(BOARDWIDTH):
+            del board[x][0]
+            board[x].insert(y, row[x])
+
+    for x, y in cells:
+        board[x][y] = BLANK
+
+
+##############################################################################
+# GAME STATISTICS FUNCTIONS
+##############################################################################
+
+def calc_drop_y(skyline, piece):
+    """Return the row where the piece lands when dropped from above the board
+
+    Computed in one step from the column tops under the piece and its bottom
+    profile, without any collision check.
+
+    """
+    drop_y = BOARDHEIGHT
+    for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['bottom']:
+        drop_y = min(drop_y, skyline[x + piece['x']] - 1 - y)
+
+    return drop_y
+
+
+def drop_piece(board, piece, skyline, backend=LIST_BACKEND):
+    """Move the piece straight down from its current row until it lands
+
+    Uses calc_drop_y whenever the columns under the piece are clear down to
+    the skyline. Only a piece already below a column top (a block above one
+    of its cells) falls back to stepping down with is_valid_position.
+
+    """
+    drop_y = calc_drop_y(skyline, piece)
+    if drop_y >= piece['y']:
+        piece['y'] = drop_y
+        return
+
+    while backend.is_valid_position(board, piece, adj_X=0, adj_Y=1):
+        piece['y']+=1
+
+
+def calc_move_info(board, piece, x, r, total_holes_bef, total_blocking_bloks_bef, skyline=None):
+    """Calculate informations based on the current play
+
+    The skyline of the board (see get_skyline) can be passed in when many
+    moves are calculated on the same board.
+
+    """
+    piece['rotation'] = r
+    piece['y']        = 0
+    piece['x']        = x
+
+    # Check if it's a valid position
+    if (not is_valid_position(board, piece)):
+        return [False]
+
+    # Goes down the piece to where it lands
+    if skyline is None:
+        skyline = get_skyline(board)
+    drop_piece(board, piece, skyline)
+
+    # Calculate the sides in contact
+    piece_sides, floor_sides, wall_sides = calc_sides_in_contact(board, piece)
+
+    # Play the move on the board itself and calculate removed lines; the
+    # board is rolled back once the heuristics are known
+    num_removed_lines, undo = apply_move(board, piece)
+
+    total_blocking_block = 0
+    total_holes          = 0
+    max_height           = 0
+
+    for x2 in range(0, BOARDWIDTH):
+        b = calc_heuristics(board, x2)
+        total_holes += b[0]
+        total_blocking_block += b[1]
+        max_height += b[2]
+
+    undo_move(board, undo)
+
+    new_holes           = total_holes - total_holes_bef
+    new_blocking_blocks = total_blocking_block - total_blocking_bloks_bef
+
+    return [True, max_height, num_removed_lines, new_holes, new_blocking_blocks, piece_sides, floor_sides, wall_sides]
+
+def calc_initial_move_info(board):
+    total_holes          = 0
+    total_blocking_bocks = 0
+
+    for x2 in range(0, BOARDWIDTH):
+        b = calc_heuristics(board, x2)
+
+        total_holes          += b[0]
+        total_blocking_bocks += b[1]
+
+    return total_holes, total_blocking_bocks
+
+def calc_heuristics(board, x):
+    """Calculate heuristics
+
+    The heuristics are composed by: number of holes, number of blocks above
+    hole and maximum height.
+
+    """
+    total_holes        = 0
+    locals_holes       = 0
+    blocks_above_holes = 0
+    is_hole_exist      = False
+    sum_heights        = 0
+
+    for y in range(BOARDHEIGHT-1, -1,-1):
+        if board[x][y] == BLANK:
+            locals_holes += 1
+        else:
+            sum_heights += BOARDHEIGHT-y
+
+            if locals_holes > 0:
+                total_holes += locals_holes
+                locals_holes = 0
+
+            if total_holes > 0:
+                blocks_above_holes += 1
+
+    return total_holes, blocks_above_holes, sum_heights
+
+def calc_sides_in_contact(board, piece):
+    """Calculate sides in contacts
+
+    For every block of the piece: touching a wall, touching the floor, or
+    touching a board block below, on the left or on the right of it.
+
+    """
+    piece_sides = 0
+    floor_sides = 0
+    wall_sides  = 0
+
+    for x, y in PIECE_TABLE[piece['shape']][piece['rotation']]['cells']:
+        x += piece['x']
+        y += piece['y']
+
+        # Wall
+        if x == 0 or x == BOARDWIDTH-1:
+            wall_sides += 1
+
+        # Floor, or other pieces below
+        if y == BOARDHEIGHT-1:
+            floor_sides += 1
+        elif board[x][y+1] != BLANK:
+            piece_sides += 1
+
+        # Other pieces on the sides
+        if x > 0 and board[x-1][y] != BLANK:
+            piece_sides += 1
+
+        if x < BOARDWIDTH-1 and board[x+1][y] != BLANK:
+            piece_sides += 1
+
+    return  piece_sides, floor_sides, wall_sides
+
+
+##############################################################################
+# MOVE GENERATION
+##############################################################################
+
+def GenerateAllPossibleMovesWithScores(board , piece, current_chromosome, backend=LIST_BACKEND):
+    moves = []
+    skyline = backend.get_skyline(board)
+    for rotation in range(0 , len(PIECES[piece['shape']])):
+        for x in PIECE_TABLE[piece['shape']][rotation]['x_range']:
+            MoveInfo = backend.calc_move_info(board , piece , x , rotation , 0 , 0, skyline)
+            isValidMove = MoveInfo[0]
+            if not isValidMove:
+                continue
+            move_score = CalculateFitnessScore(MoveInfo , current_chromosome)
+            moves.append((rotation, x, move_score))
+    return moves
+
+
+def chooseBestMove(moves):
+    moves.sort(key=lambda move: move[2] , reverse=True)
+    return moves[0]
+
+
+def CalculateFitnessScore(MoveInfo , CurrentChromosome):
+    score = 0
+    for Feature , Value in zip(MoveInfo[1:],CurrentChromosome):
+        score += Feature * Value
+    return score
+
+
+def GenerateAllPossibleMovesWithScoresBeastMode(board, falling_piece, current_chromosome, next_piece=None, backend=LIST_BACKEND,
+                                                table=None):
+    """Score every move of the falling piece adding the best move of the next piece
+
+    Exhaustive 2-ply lookahead (see beam_search). A TranspositionTable kept
+    from move to move saves scoring boards again.
+
+    """
+    pieces = [falling_piece]
+    if next_piece is not None:
+        pieces.append(next_piece)
+
+    return beam_search(board, pieces, current_chromosome, depth=len(pieces), table=table, backend=backend)
+
+
+##############################################################################
+# LOOKAHEAD SEARCH
+##############################################################################
+
+class TranspositionTable:
+    """Bounded LRU cache of board expansions for the lookahead search
+
+    Maps (board key, piece shape, chromosome) to the scored moves of that
+    piece on that board, so boards reached again (by another first move, or
+    on a later turn) are not scored twice. hits and misses count the lookups.
+
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries  = OrderedDict()
+        self.hits     = 0
+        self.misses   = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the entry of key (None if missing), marking it recently used"""
+
+        moves = self.entries.get(key)
+        if moves is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+
+        return moves
+
+    def put(self, key, moves):
+        """Add an entry, dropping the least recently used one when full"""
+
+        self.entries[key] = moves
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+def score_board_moves(board, piece, current_chromosome, table=None, backend=LIST_BACKEND):
+    """Return the (rotation, x, y, score) of every valid move of the piece on the board
+
+    y is where the piece lands. With a TranspositionTable the moves are looked
+    up first and stored after being scored.
+
+    """
+    if table is not None:
+        key   = (backend.get_board_key(board), piece['shape'], tuple(current_chromosome))
+        moves = table.get(key)
+        if moves is not None:
+            return moves
+
+    piece   = dict(piece)
+    skyline = backend.get_skyline(board)
+    moves   = []
+    for rotation in range(len(PIECES[piece['shape']])):
+        for x in PIECE_TABLE[piece['shape']][rotation]['x_range']:
+            move_info = backend.calc_move_info(board, piece, x, rotation, 0, 0, skyline)
+            if move_info[0]:
+                moves.append((rotation, x, piece['y'], CalculateFitnessScore(move_info, current_chromosome)))
+
+    if table is not None:
+        table.put(key, moves)
+
+    return moves
+
+
+def apply_path(board, path, backend=LIST_BACKEND):
+    """Play the placed pieces of a search path on the board, returning their undo logs"""
+
+    undos = []
+    for piece in path:
+        num_removed_lines, undo = backend.apply_move(board, piece)
+        undos.append(undo)
+
+    return undos
+
+
+def undo_path(board, undos, backend=LIST_BACKEND):
+    """Roll back the moves played by apply_path"""
+
+    for undo in reversed(undos):
+        backend.undo_move(board, undo)
+
+
+# Returned by score_unknown_pieces when its deadline passed before it finished
+SEARCH_TIMED_OUT = object()
+
+
+def score_unknown_pieces(board, plies, current_chromosome, table=None, backend=LIST_BACKEND, deadline=None):
+    """Return the worst case over every shape of the best summed score of placing plies unknown pieces
+
+    Each ply, the piece can be any shape: its score is the best score of a
+    move of that shape (plus the following plies), and the worst of these
+    over the shapes is kept. Returns None when a shape cannot be placed,
+    i.e. the board can top out, and SEARCH_TIMED_OUT once the deadline
+    (a time.time() value) is passed.
+
+    """
+    worst = None
+    for code in range(len(SHAPES)):
+        piece = decode_piece(code << 4)
+        best  = None
+        for rotation, x, y, move_score in score_board_moves(board, piece, current_chromosome, table, backend):
+            if deadline is not None and time.time() > deadline:
+                return SEARCH_TIMED_OUT
+            if plies > 1:
+                undos = apply_path(board, [dict(piece, rotation=rotation, x=x, y=y)], backend)
+                value = score_unknown_pieces(board, plies - 1, current_chromosome, table, backend, deadline)
+                undo_path(board, undos, backend)
+                if value is SEARCH_TIMED_OUT:
+                    return value
+                if value is None:
+                    continue
+                move_score += value
+            if best is None or move_score > best:
+                best = move_score
+
+        if best is None:
+            return None
+        if worst is None or best < worst:
+            worst = best
+
+    return worst
+
+
+def beam_search(board, pieces, current_chromosome, depth=2, beam_width=None, time_budget=None, table=None,
+                backend=LIST_BACKEND):
+    """Search up to `depth` plies ahead and return the (rotation, x, score) moves of pieces[0]
+
+    Ply i places pieces[i] on every board of the beam, and only the
+    beam_width best boards by summed move scores (None: all of them) are
+    kept for the next ply. The plies beyond the known pieces are scored at
+    the end on every board of the beam with score_unknown_pieces, the worst
+    case over every shape. The score of a first move is the best summed
+    score among the boards it leads to in the deepest complete ply; first
+    moves whose boards were all pruned or topped out are left out. With a
+    time_budget (seconds), the search stops at the deadline and returns the
+    scores of the last complete ply. A TranspositionTable, kept from move to
+    move, saves scoring boards again.
+
+    Beam boards are not copied: each one is a path of placed pieces, played
+    on the board with apply_move and rolled back after its expansion.
+
+    """
+    deadline = None
+    if time_budget is not None:
+        deadline = time.time() + time_budget
+    unknown = max(depth - len(pieces), 0)
+    depth   = min(depth, len(pieces))
+
+    # First ply: every move of the falling piece
+    roots = []
+    beam  = []
+    for rotation, x, y, move_score in score_board_moves(board, pieces[0], current_chromosome, table, backend):
+        beam.append((move_score, len(roots), [dict(pieces[0], rotation=rotation, x=x, y=y)]))
+        roots.append((rotation, x))
+
+    best_scores = [node[0] for node in beam]
+
+    for ply in range(1, depth):
+        if beam_width is not None and len(beam) > beam_width:
+            beam = heapq.nlargest(beam_width, beam, key=lambda node: node[0])
+
+        piece    = pieces[ply]
+        children = []
+        for node_score, root, path in beam:
+            if deadline is not None and time.time() > deadline:
+                return [(roots[i][0], roots[i][1], best_scores[i]) for i in range(len(roots)) if best_scores[i] is not None]
+
+            undos = apply_path(board, path, backend)
+            moves = score_board_moves(board, piece, current_chromosome, table, backend)
+            undo_path(board, undos, backend)
+
+            for rotation, x, y, move_score in moves:
+                children.append((node_score + move_score, root, path + [dict(piece, rotation=rotation, x=x, y=y)]))
+
+        if not children:
+            # Every board of the beam topped out
+            unknown = 0
+            break
+
+        best_scores = [None] * len(roots)
+        for node_score, root, path in children:
+            if best_scores[root] is None or node_score > best_scores[root]:
+                best_scores[root] = node_score
+        beam = children
+
+    if unknown > 0:
+        if beam_width is not None and len(beam) > beam_width:
+            beam = heapq.nlargest(beam_width, beam, key=lambda node: node[0])
+
+        scores = [None] * len(roots)
+        for node_score, root, path in beam:
+            if deadline is not None and time.time() > deadline:
+                return [(roots[i][0], roots[i][1], best_scores[i]) for i in range(len(roots)) if best_scores[i] is not None]
+
+            undos = apply_path(board, path, backend)
+            value = score_unknown_pieces(board, unknown, current_chromosome, table, backend, deadline)
+            undo_path(board, undos, backend)
+
+            if value is SEARCH_TIMED_OUT:
+                return [(roots[i][0], roots[i][1], best_scores[i]) for i in range(len(roots)) if best_scores[i] is not None]
+            if value is not None and (scores[root] is None or node_score + value > scores[root]):
+                scores[root] = node_score + value
+
+        # Unless every board of the beam can top out
+        if any(score is not None for score in scores):
+            best_scores = scores
+
+    return [(roots[i][0], roots[i][1], best_scores[i]) for i in range(len(roots)) if best_scores[i] is not None]
+
+
+##############################################################################
+# PIECE SEQUENCES
+##############################################################################
+
+def make_piece_codes(rng, count):
+    """Draw count pieces from the random.Random rng and return their codes as a bytearray
+
+    The pieces are drawn like get_new_piece does, so a stream seeded with s
+    gives the same pieces as get_new_piece after random.seed(s).
+
+    """
+    codes = bytearray(count)
+    for i in range(count):
+        shape    = rng.choice(SHAPES)
+        rotation = rng.randint(0, len(PIECES[shape]) - 1)
+        color    = rng.randint(0, COLOR_COUNT-1)
+        codes[i] = SHAPES.index(shape) << 4 | rotation << 2 | color
+
+    return codes
+
+
+def decode_piece(code):
+    """Return the new piece stored in a piece code"""
+
+    return {'shape': SHAPES[code >> 4],
+            'rotation': code >> 2 & 3,
+            'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
+            'y': -2, # start it above the board (i.e. less than 0)
+            'color': code & 3}
+
+
+class PieceStream:
+    """Deterministic piece sequence with its own random stream
+
+    The pieces only depend on the seed: they do not consume the global
+    random module, so games evaluated in any order or process with the same
+    seed see the same pieces. The codes are drawn in chunks as the game goes.
+    Optional first codes are played before the random ones.
+
+    """
+
+    def __init__(self, seed, length=PIECE_CHUNK_SIZE, first=b''):
+        self.rng      = random.Random(seed)
+        self.codes    = bytearray(first) + make_piece_codes(self.rng, length)
+        self.position = 0
+
+    def get_code(self, index):
+        """Return the code of piece index of the sequence, drawing it if needed"""
+
+        while index >= len(self.codes):
+            self.codes += make_piece_codes(self.rng, PIECE_CHUNK_SIZE)
+
+        return self.codes[index]
+
+    def next_piece(self):
+        """Return the next piece of the sequence, like get_new_piece"""
+
+        code = self.get_code(self.position)
+        self.position += 1
+
+        return decode_piece(code)
+
+
+##############################################################################
+# PROFILING
+##############################################################################
+
+class Profiler:
+    """Named phase timers and counters
+
+    lap(name) charges the time since the previous lap to the phase name, so
+    a sequence of phases costs one clock read each. Functions taking an
+    optional profiler only call it when one is given: disabled profiling
+    costs a None check per phase.
+
+    """
+
+    def __init__(self):
+        self.times    = {}
+        self.calls    = {}
+        self.counters = {}
+        self.last     = time.perf_counter()
+
+    def lap(self, name=None):
+        """Charge the time since the last lap to phase name (None: restart the clock)"""
+
+        now = time.perf_counter()
+        if name is not None:
+            self.times[name] = self.times.get(name, 0) + now - self.last
+            self.calls[name] = self.calls.get(name, 0) + 1
+        self.last = now
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def merge(self, other):
+        """Add the timers and counters of another profiler to this one"""
+
+        for name in other.times:
+            self.times[name] = self.times.get(name, 0) + other.times[name]
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        for name in other.counters:
+            self.count(name, other.counters[name])
+
+    def report(self, title):
+        """Return the time, time share and calls of every phase, then the counters (per piece too)"""
+
+        total = sum(self.times.values())
+        lines = [title]
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append(f"\t{name}: {self.times[name]:.3f}s ({self.times[name] / max(total, 1e-9):.1%}), "
+                         f"{self.calls[name]} calls")
+
+        pieces = self.counters.get('pieces')
+        for name in sorted(self.counters):
+            line = f"\t{name}: {self.counters[name]}"
+            if pieces and name != 'pieces':
+                line += f" ({self.counters[name] / pieces:.1f} per piece)"
+            lines.append(line)
+
+        return '\n'.join(lines)
+
+
+##############################################################################
+# HEADLESS GAME
+##############################################################################
+
+def calc_fitness(score, moves_taken, censored):
+    """Return the ranking key of a game result (higher is better)
+
+    A censored game was still running when its budget ran out, so it ranks
+    above every game that ended. Censored games are compared on points per
+    piece, since a time budget stops them after different numbers of pieces,
+    and finished games on their score.
+
+    """
+    if censored:
+        return 1, score / max(moves_taken, 1)
+
+    return 0, score
+
+
+def calc_lines_score(num_removed_lines):
+    """Bonus score for complete lines at once
+
+    40   pts for 1 line
+    120  pts for 2 lines
+    300  pts for 3 lines
+    1200 pts for 4 lines
+
+    """
+    if (num_removed_lines == 1):
+        return 40
+    elif (num_removed_lines == 2):
+        return 120
+    elif (num_removed_lines == 3):
+        return 300
+    elif (num_removed_lines == 4):
+        return 1200
+    return 0
+
+
+def play_game(current_chromosome, beast_mode=False, renderer=None, backend=LIST_BACKEND,
+              move_generator=GenerateAllPossibleMovesWithScores, search=None, max_pieces=None, time_limit=None,
+              pieces=None, board=None, profiler=None, verbose=True):
+    """Play an AI game and return score, moves taken, lines removed and censored
+
+    Runs without any display at full CPU speed. A renderer can optionally be
+    attached to draw the game (and throttle it) after every placement. The
+    game is played until game over, or until it runs out of its pieces or
+    time budget: it is then stopped and returned as censored.
+
+    Args:
+        current_chromosome: weights used to score every candidate move
+        beast_mode: choose moves with the beam_search lookahead
+        renderer: callable(board, score, total_lines_removed, moves_taken,
+            next_piece) called after every placement, or None for headless
+        backend: board backend module (LIST_BACKEND, bitboard or boardstate)
+        move_generator: generator used when not in beast mode, e.g.
+            vectorized.GenerateAllPossibleMovesWithScoresVectorized
+        search: beam_search options in beast mode (depth, beam_width,
+            time_budget, table). Only the next piece is known, as on screen:
+            deeper plies are searched over every shape.
+        max_pieces: stop the game once this many pieces are placed (None:
+            no limit)
+        time_limit: stop the game after this many seconds (None: no limit)
+        pieces: PieceStream the pieces come from (None: get_new_piece, i.e.
+            the global random module)
+        board: board of the backend to start from, played on in place
+            (None: a blank board)
+        profiler: Profiler timing the spawn, move generation (with the
+            heuristics of every candidate), drop, line clearing and drawing
+            phases, and counting pieces and candidate moves (None: no
+            profiling)
+        verbose: print the final score (off for timed runs)
+
+    """
+    if search is None:
+        search = {}
+    new_piece = get_new_piece
+    if pieces is not None:
+        new_piece = pieces.next_piece
+
+    deadline = None
+    if time_limit is not None:
+        deadline = time.time() + time_limit
+
+    # Setup variables
+    if board is None:
+        board = backend.get_blank_board()
+    score = 0
+    total_lines_removed = 0
+    falling_piece = new_piece()
+    next_piece = new_piece()
+    moves_taken = 0
+    if profiler is not None:
+        profiler.lap()
+    while True:
+        # Game Loop
+        if (falling_piece == None):
+            if ((max_pieces is not None and moves_taken >= max_pieces)
+                    or (deadline is not None and time.time() > deadline)):
+                # Out of budget: the game is stopped before its end
+                if verbose:
+                    print(f"Score is now {score} (stopped)")
+                return score, moves_taken, total_lines_removed, True
+
+            # No falling piece in play, so start a new piece at the top
+            falling_piece = next_piece
+            next_piece = new_piece()
+            score += 1
+            if (not backend.is_valid_position(board, falling_piece)):
+                # GAME-OVER
+                # Can't fit a new piece on the board, so game over.
+                if verbose:
+                    print(f"Score is now {score}")
+                return score, moves_taken, total_lines_removed, False
+
+        if profiler is not None:
+            profiler.lap('spawn')
+
+        if beast_mode:
+            moves = beam_search(board, [falling_piece, next_piece], current_chromosome, backend=backend, **search)
+        else:
+            moves = move_generator(board, falling_piece, current_chromosome, backend)
+        if profiler is not None:
+            profiler.lap('move generation')
+            profiler.count('pieces')
+            profiler.count('candidate moves', len(moves))
+
+        if (len(moves) == 0):  # IF there is no moves availabe to  play
+            if verbose:
+                print(f"Score is now {score}")
+            return score, moves_taken, total_lines_removed, False
+        best_move = chooseBestMove(moves) #[rotation , X , Score]
+        falling_piece["x"] = best_move[1]
+        falling_piece["y"] = -1
+        falling_piece['rotation'] = best_move[0]
+
+        drop_piece(board, falling_piece, backend.get_skyline(board), backend)
+        if profiler is not None:
+            profiler.lap('drop')
+        # Falling piece has landed, set it on the board
+        backend.add_to_board(board, falling_piece)
+        num_removed_lines = backend.remove_complete_lines(board)
+        total_lines_removed += num_removed_lines
+        score += calc_lines_score(num_removed_lines)
+        falling_piece = None
+        if profiler is not None:
+            profiler.lap('line clearing')
+
+        if renderer is not None:
+            renderer(backend.to_board(board), score, total_lines_removed, moves_taken, next_piece)
+            if profiler is not None:
+                profiler.lap('drawing')
+        moves_taken += 1
@@ -0,0 +1,236 @@
+import json, time, sqlite3, hashlib, argparse
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Experiment store: an SQLite database gathering the games of many training
+# runs, to query them across runs and to reuse their results (it backs the
+# training.FitnessCache of the runs writing to it).
+#
+#   runs         one row per run (id shared with the results log, mode, options)
+#   generations  best and mean score of every generation of a run
+#   chromosomes  every distinct gene vector, with a hash of its genes
+#   evaluations  one row per game played: chromosome, piece seed, budget,
+#                result and lines per piece
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id          TEXT PRIMARY KEY,
+    started     REAL,
+    mode        TEXT,
+    options     TEXT
+);
+CREATE TABLE IF NOT EXISTS generations (
+    run         TEXT REFERENCES runs(id),
+    generation  INTEGER,
+    chromosomes INTEGER,
+    best_score  REAL,
+    mean_score  REAL,
+    finished    REAL,
+    PRIMARY KEY (run, generation)
+);
+CREATE TABLE IF NOT EXISTS chromosomes (
+    id          INTEGER PRIMARY KEY,
+    genes       TEXT UNIQUE,
+    gene_hash   TEXT
+);
+CREATE TABLE IF NOT EXISTS evaluations (
+    id              INTEGER PRIMARY KEY,
+    run             TEXT REFERENCES runs(id),
+    generation      INTEGER,
+    chromosome      INTEGER REFERENCES chromosomes(id),
+    seed            INTEGER,
+    max_pieces      INTEGER,
+    time_limit      REAL,
+    score           REAL,
+    moves           INTEGER,
+    lines           INTEGER,
+    censored        INTEGER,
+    lines_per_piece REAL,
+    time            REAL
+);
+CREATE INDEX IF NOT EXISTS chromosomes_gene_hash ON chromosomes (gene_hash);
+CREATE INDEX IF NOT EXISTS evaluations_game ON evaluations (chromosome, seed, max_pieces, time_limit);
+CREATE INDEX IF NOT EXISTS evaluations_score ON evaluations (score);
+CREATE INDEX IF NOT EXISTS evaluations_lines_per_piece ON evaluations (lines_per_piece);
+CREATE INDEX IF NOT EXISTS evaluations_run ON evaluations (run, generation);
+'''
+
+# Several processes (islands, concurrent runs) write to the same store: the
+# database is in WAL mode, so readers never block, and every write is
+# committed at once, so no process holds the write lock between games.
+# A writer waits up to LOCK_TIMEOUT seconds for another one to commit.
+LOCK_TIMEOUT = 30
+
+# Columns top_chromosomes can rank by
+RANKINGS = ('lines_per_piece', 'score', 'lines', 'moves')
+
+
+##############################################################################
+# GENES
+##############################################################################
+
+def encode_genes(chromosome):
+    """Return the genes as the JSON text stored in the chromosomes table (-1 and -1.0 are the same gene)"""
+
+    return json.dumps([float(gene) for gene in chromosome])
+
+
+def calc_gene_hash(chromosome):
+    """Return the short hash indexing a gene vector"""
+
+    return hashlib.sha1(encode_genes(chromosome).encode()).hexdigest()[:16]
+
+
+##############################################################################
+# EXPERIMENT STORE
+##############################################################################
+
+class ExperimentStore:
+    """Runs, generations, chromosomes and games of an SQLite experiment database
+
+    The training loop opens a run with begin_run and sets the generation
+    being played; every game it plays is then added with add_evaluation
+    (through the FitnessCache) and every finished generation with
+    add_generation. find_evaluation looks up the result of a game already
+    played by any run, for fitness reuse.
+
+    """
+
+    def __init__(self, path):
+        self.path       = path
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.run_id     = None
+        self.generation = None
+
+    def close(self):
+        self.connection.close()
+
+    def begin_run(self, run_id, mode, options=None):
+        """Add a run; the following evaluations belong to it"""
+
+        self.run_id     = run_id
+        self.generation = None
+        self.connection.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)',
+                                (run_id, time.time(), mode, json.dumps(options or {}, default=str)))
+        self.connection.commit()
+
+    def get_chromosome_id(self, chromosome):
+        """Return the id of a gene vector, adding it if it is new"""
+
+        # Another process may add the same genes at the same time
+        genes = encode_genes(chromosome)
+        self.connection.execute('INSERT OR IGNORE INTO chromosomes (genes, gene_hash) VALUES (?, ?)',
+                                (genes, calc_gene_hash(chromosome)))
+
+        return self.connection.execute('SELECT id FROM chromosomes WHERE genes = ?', (genes,)).fetchone()[0]
+
+    def add_evaluation(self, chromosome, seed, max_pieces, time_limit, result):
+        """Add a game of the current run and generation"""
+
+        score, moves_taken, lines_removed, censored = result
+        self.connection.execute('INSERT INTO evaluations (run, generation, chromosome, seed, max_pieces, time_limit, '
+                                'score, moves, lines, censored, lines_per_piece, time) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (self.run_id, self.generation, self.get_chromosome_id(chromosome), seed, max_pieces,
+                                 time_limit, score, moves_taken, lines_removed, int(censored),
+                                 lines_removed / max(moves_taken, 1), time.time()))
+        self.connection.commit()
+
+    def find_evaluation(self, chromosome, seed, max_pieces, time_limit):
+        """Return the (score, moves taken, lines removed, censored) of a game already played, or None"""
+
+        row = self.connection.execute('SELECT score, moves, lines, censored FROM evaluations '
+                                      'WHERE chromosome = (SELECT id FROM chromosomes WHERE genes = ?) '
+                                      'AND seed = ? AND max_pieces IS ? AND time_limit IS ? LIMIT 1',
+                                      (encode_genes(chromosome), seed, max_pieces, time_limit)).fetchone()
+        if row is None:
+            return None
+
+        score, moves_taken, lines_removed, censored = row
+        return int(score), moves_taken, lines_removed, bool(censored)
+
+    def add_generation(self, generation, results):
+        """Add the (score, moves taken, lines removed, censored) results of a finished generation of the run"""
+
+        scores = [result[0] for result in results]
+        self.connection.execute('INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?, ?)',
+                                (self.run_id, generation, len(scores), max(scores), sum(scores) / len(scores),
+                                 time.time()))
+        self.connection.commit()
+
+    # Queries
+
+    def get_runs(self):
+        """Return the (id, started, mode, games played) of every run, oldest first"""
+
+        return self.connection.execute('SELECT runs.id, runs.started, runs.mode, COUNT(evaluations.id) FROM runs '
+                                       'LEFT JOIN evaluations ON evaluations.run = runs.id '
+                                       'GROUP BY runs.id ORDER BY runs.started').fetchall()
+
+    def get_generations(self, run_id):
+        """Return the (generation, chromosomes, best score, mean score) of a run"""
+
+        return self.connection.execute('SELECT generation, chromosomes, best_score, mean_score FROM generations '
+                                       'WHERE run = ? ORDER BY generation', (run_id,)).fetchall()
+
+    def top_chromosomes(self, limit=20, by='lines_per_piece', min_games=1):
+        """Return the (genes, mean of by, games played) of the best chromosomes ever
+
+        Chromosomes are ranked by the mean of the `by` column (one of
+        RANKINGS) over all their games, of every run.
+
+        """
+        if by not in RANKINGS:
+            raise ValueError(f"cannot rank chromosomes by {by!r}")
+
+        rows = self.connection.execute(f'SELECT chromosomes.genes, AVG(evaluations.{by}) AS value, COUNT(*) '
+                                       'FROM evaluations JOIN chromosomes ON chromosomes.id = evaluations.chromosome '
+                                       'GROUP BY evaluations.chromosome HAVING COUNT(*) >= ? '
+                                       'ORDER BY value DESC LIMIT ?', (min_games, limit)).fetchall()
+
+        return [(json.loads(genes), value, games) for genes, value, games in rows]
+
+    def get_evaluations(self, chromosome):
+        """Return the (run, generation, seed, max_pieces, time_limit, score, moves, lines, censored) games of a gene vector"""
+
+        return self.connection.execute('SELECT run, generation, seed, max_pieces, time_limit, score, moves, lines, '
+                                       'censored FROM evaluations '
+                                       'JOIN chromosomes ON chromosomes.id = evaluations.chromosome '
+                                       'WHERE chromosomes.gene_hash = ? AND chromosomes.genes = ? ORDER BY time',
+                                       (calc_gene_hash(chromosome), encode_genes(chromosome))).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query a Tetris AI experiment store')
+    parser.add_argument('database', help='SQLite experiment store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('runs', help='list the runs')
+    generations = commands.add_parser('generations', help='list the generations of a run')
+    generations.add_argument('run', help='run id')
+    top = commands.add_parser('top', help='best chromosomes ever')
+    top.add_argument('--by', choices=RANKINGS, default='lines_per_piece', help='mean ranking the chromosomes')
+    top.add_argument('--limit', type=int, default=20, help='chromosomes listed')
+    top.add_argument('--min-games', type=int, default=1, help='only chromosomes with at least this many games')
+    chromosome = commands.add_parser('chromosome', help='all the games of a gene vector')
+    chromosome.add_argument('genes', type=float, nargs='+', help='genes of the chromosome')
+    args = parser.parse_args()
+
+    store = ExperimentStore(args.database)
+    if args.command == 'runs':
+        for run_id, started, mode, games in store.get_runs():
+            print(f"{run_id}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}\t{mode}\t{games} games")
+    elif args.command == 'generations':
+        for generation, chromosomes, best_score, mean_score in store.get_generations(args.run):
+            print(f"Evolution # {generation}\t{chromosomes} chromosomes\tbest {best_score}\tmean {mean_score:.1f}")
+    elif args.command == 'top':
+        for genes, value, games in store.top_chromosomes(args.limit, args.by, args.min_games):
+            print(f"{genes}\t{args.by} {value:.3f}\t{games} games")
+    else:
+        for row in store.get_evaluations(args.genes):
+            print('\t'.join(str(value) for value in row))
+    store.close()
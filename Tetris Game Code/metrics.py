@@ -0,0 +1,169 @@
+import os, json, time, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import engine
+from engine import BOARDHEIGHT
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Live metrics of long training runs and Beast Mode games, for monitoring
+# without a display: a JSON file rewritten every METRICS_INTERVAL seconds
+# and/or a local HTTP endpoint returning the same JSON on every GET.
+METRICS_INTERVAL = 5
+
+
+##############################################################################
+# METRICS
+##############################################################################
+
+class MetricsExporter:
+    """Throughput of a run, published to a JSON file and/or a local HTTP endpoint
+
+    Finished games are added with record_game (with the worker that played
+    them and how long it took, for the worker utilization) and the game
+    being played here with record_placement after every move. add_cache
+    adds any object with hits and misses (FitnessCache, TranspositionTable)
+    and set_value free values such as the current generation. With a path,
+    a daemon thread also rewrites the file every interval seconds, so it
+    stays fresh while long games run. All of them can be called while the
+    HTTP endpoint or that thread read the metrics.
+
+    """
+
+    def __init__(self, path=None, port=None, interval=METRICS_INTERVAL):
+        self.path        = path
+        self.interval    = interval
+        self.started     = time.time()
+        self.published   = 0
+        self.games       = 0
+        self.pieces      = 0
+        self.lines       = 0
+        self.best_score  = None
+        self.last_score  = None
+        self.worker_busy = {}
+        self.caches      = {}
+        self.values      = {}
+        self.game        = None
+        self.server      = None
+        self.lock        = threading.RLock()
+        self.stopped     = threading.Event()
+
+        if port is not None:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = json.dumps(exporter.snapshot()).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        if path is not None:
+            threading.Thread(target=self.publish_every_interval, daemon=True).start()
+
+    def record_game(self, result, worker=None, seconds=None):
+        """Add a finished (score, moves taken, lines removed, censored) game"""
+
+        score, moves_taken, lines_removed, censored = result
+        with self.lock:
+            self.games  += 1
+            self.pieces += moves_taken
+            self.lines  += lines_removed
+            self.last_score = score
+            if self.best_score is None or score > self.best_score:
+                self.best_score = score
+            if worker is not None:
+                self.worker_busy[worker] = self.worker_busy.get(worker, 0) + seconds
+
+        self.publish()
+
+    def record_placement(self, board, score, total_lines_removed, moves_taken):
+        """Update the game being played (engine list board) after a placement"""
+
+        board_height = BOARDHEIGHT - min(engine.get_skyline(board))
+        with self.lock:
+            if self.game is None or moves_taken < self.game['pieces']:
+                self.game = {'started': time.time()}
+
+            elapsed = max(time.time() - self.game['started'], 1e-9)
+            self.game.update(score=score, lines=total_lines_removed, pieces=moves_taken + 1, board_height=board_height,
+                             pieces_per_second=(moves_taken + 1) / elapsed,
+                             lines_per_second=total_lines_removed / elapsed)
+
+        self.publish()
+
+    def add_cache(self, name, cache):
+        """Report the hits and misses of cache as name_cache"""
+
+        with self.lock:
+            self.caches[name] = cache
+
+    def set_value(self, name, value):
+        """Report a free value, e.g. the current generation"""
+
+        with self.lock:
+            self.values[name] = value
+
+    def snapshot(self):
+        """Return the current metrics as a JSON-serializable dict"""
+
+        with self.lock:
+            now     = time.time()
+            elapsed = max(now - self.started, 1e-9)
+            metrics = {'time': now, 'elapsed': elapsed, 'games': self.games, 'pieces': self.pieces,
+                       'lines': self.lines, 'pieces_per_second': self.pieces / elapsed,
+                       'lines_per_second': self.lines / elapsed, 'best_score': self.best_score,
+                       'last_score': self.last_score}
+            metrics.update(self.values)
+
+            if self.game is not None:
+                metrics['game'] = {name: value for name, value in self.game.items() if name != 'started'}
+            if self.worker_busy:
+                metrics['worker_utilization'] = {str(worker): busy / elapsed
+                                                 for worker, busy in self.worker_busy.items()}
+            for name, cache in self.caches.items():
+                lookups = cache.hits + cache.misses
+                metrics[f'{name}_cache'] = {'hits': cache.hits, 'misses': cache.misses,
+                                            'hit_rate': cache.hits / lookups if lookups else None}
+
+        return metrics
+
+    def publish(self, force=False):
+        """Rewrite the metrics file, at most every interval seconds unless forced"""
+
+        if self.path is None:
+            return
+
+        with self.lock:
+            if not force and time.time() - self.published < self.interval:
+                return
+
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(temp_path, self.path)
+            self.published = time.time()
+
+    def publish_every_interval(self):
+        # Daemon thread: keeps the file fresh between finished games
+        while not self.stopped.wait(self.interval):
+            self.publish(force=True)
+
+    def close(self):
+        """Publish the final metrics and stop the publishing thread and the HTTP endpoint"""
+
+        self.stopped.set()
+        self.publish(force=True)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,89 @@
+import random, math
+from engine import calc_fitness
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Optimizers drive the training loop ask/tell style: ask() returns the
+# chromosomes to play next, and tell() takes them back with their (score,
+# moves taken, lines removed, censored) results. Nothing here needs pygame,
+# so the optimizers can run with any evaluation (sequential, pool, batch).
+
+
+##############################################################################
+# GENETIC ALGORITHM
+##############################################################################
+
+class GeneticOptimizer:
+    """The genetic algorithm as an ask/tell optimizer
+
+    breed turns the [chromosome, score, moves taken, censored] entries of a
+    generation into the next population (Main.next_generation: selection,
+    crossover and mutation).
+
+    """
+
+    def __init__(self, population, breed):
+        self.population = population
+        self.breed      = breed
+        self.generation = 0
+
+    def ask(self):
+        """Return the chromosomes of the current generation"""
+
+        return self.population
+
+    def tell(self, chromosomes, results):
+        """Breed the next generation from the results of the chromosomes"""
+
+        entries = [[chromosome, score, moves_taken, censored]
+                   for chromosome, (score, moves_taken, lines_removed, censored) in zip(chromosomes, results)]
+        self.population  = self.breed(entries)
+        self.generation += 1
+
+
+##############################################################################
+# CROSS-ENTROPY METHOD
+##############################################################################
+
+class CrossEntropyOptimizer:
+    """Noisy cross-entropy method over a diagonal Gaussian
+
+    Every generation samples size chromosomes from N(mean, std^2), then
+    refits mean and std to the elite_rate best of them (ranked with
+    calc_fitness). Extra noise, noise at first and decreasing by noise_decay
+    per generation, is added to the variance so the search does not collapse
+    on the first good region it finds. The genes are drawn from the global
+    random module, like the genetic algorithm.
+
+    """
+
+    def __init__(self, size, length, elite_rate=0.25, initial_std=5.0, noise=4.0, noise_decay=0.5):
+        self.size        = size
+        self.mean        = [0.0] * length
+        self.std         = [initial_std] * length
+        self.elite_rate  = elite_rate
+        self.noise       = noise
+        self.noise_decay = noise_decay
+        self.generation  = 0
+
+    def ask(self):
+        """Sample the chromosomes of the current generation"""
+
+        return [[random.gauss(mean, std) for mean, std in zip(self.mean, self.std)] for i in range(self.size)]
+
+    def tell(self, chromosomes, results):
+        """Refit the distribution to the elite chromosomes"""
+
+        ranked = sorted(range(len(chromosomes)), key=lambda i: calc_fitness(results[i][0], results[i][1], results[i][3]),
+                        reverse=True)
+        elites = [chromosomes[i] for i in ranked[:max(1, int(len(chromosomes) * self.elite_rate))]]
+
+        noise = max(self.noise - self.noise_decay * self.generation, 0)
+        for gene in range(len(self.mean)):
+            values = [elite[gene] for elite in elites]
+            mean   = sum(values) / len(values)
+            self.mean[gene] = mean
+            self.std[gene]  = math.sqrt(sum((value - mean) ** 2 for value in values) / len(values) + noise)
+        self.generation += 1
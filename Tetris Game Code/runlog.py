@@ -0,0 +1,140 @@
+import os, json, time, uuid
+from array import array
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Structured result log: one JSON line per evaluation, appended to the log
+# file LOG_BUFFER_SIZE records at a time. A record holds:
+#   run         id of the run that wrote it
+#   generation  generation index (None outside the generational loops)
+#   index       index of the chromosome in its generation (or evaluation
+#               number in steady-state mode)
+#   chromosome  genes
+#   seed        piece seed of the game, list of seeds for races and corpus
+#               continuations, None for unseeded games
+#   score, moves, lines, censored  the game result (means for races)
+#   eliminated  dropped out of a race
+#   seconds     wall time the evaluation took (all the games of a race or
+#               corpus continuations, 0 for results found in the fitness cache)
+#   time        wall-clock time the result was logged at (seconds since the epoch)
+# plus any extra fields of the writer (e.g. island).
+LOG_BUFFER_SIZE = 64
+
+# Numeric columns of load_columns and their array type codes
+NUMERIC_COLUMNS = {'generation': 'l', 'index': 'l', 'score': 'd', 'moves': 'd', 'lines': 'd', 'censored': 'b',
+                   'eliminated': 'b', 'seconds': 'd', 'time': 'd'}
+
+
+##############################################################################
+# WRITING
+##############################################################################
+
+def make_run_id():
+    """Return a new unique run id (start time and random suffix)"""
+
+    # uuid4 does not touch the random module, so the GA random state is kept
+    return time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+
+
+class RunLog:
+    """Append-only log of the evaluations of a run
+
+    Records are kept in memory and appended to the file buffer_size at a
+    time, with one write, and on flush or close.
+
+    """
+
+    def __init__(self, path, run_id=None, buffer_size=LOG_BUFFER_SIZE):
+        self.path        = path
+        self.run_id      = run_id if run_id is not None else make_run_id()
+        self.buffer_size = buffer_size
+        self.buffer      = []
+
+    def record(self, generation, index, chromosome, seed, result, eliminated=False, seconds=None, **fields):
+        """Log the (score, moves taken, lines removed, censored) result of a chromosome and how long it took"""
+
+        score, moves_taken, lines_removed, censored = result
+        record = {'run': self.run_id, 'generation': generation, 'index': index, 'chromosome': list(chromosome),
+                  'seed': seed, 'score': score, 'moves': moves_taken, 'lines': lines_removed, 'censored': censored,
+                  'eliminated': eliminated, 'seconds': seconds, 'time': time.time()}
+        record.update(fields)
+        self.buffer.append(json.dumps(record))
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered records to the file"""
+
+        if self.buffer:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+
+
+##############################################################################
+# READING
+##############################################################################
+
+def read_records(paths):
+    """Yield the records of one log file or a list of them, one at a time"""
+
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def load_columns(paths, runs=None):
+    """Load the records of log files into columns
+
+    Returns a dict of columns, one value per record: an array of the
+    numeric fields (NUMERIC_COLUMNS, -1 when None), one 'd'
+    array per gene ('gene_0', 'gene_1'...) and lists for run, seed and the
+    extra fields. The arrays support the buffer protocol, so
+    numpy.asarray(columns['score']) does not copy them.
+
+    Args:
+        paths: log file or list of log files
+        runs: only load the records of these run ids (None: all of them)
+
+    """
+    columns = {'run': [], 'seed': []}
+    for name, code in NUMERIC_COLUMNS.items():
+        columns[name] = array(code)
+
+    count = 0
+    for record in read_records(paths):
+        if runs is not None and record['run'] not in runs:
+            continue
+
+        for gene, value in enumerate(record['chromosome']):
+            columns.setdefault(f'gene_{gene}', array('d', [float('nan')] * count)).append(value)
+        for name, value in record.items():
+            if name == 'chromosome':
+                continue
+            if name in NUMERIC_COLUMNS:
+                value = -1 if value is None else value
+            elif name not in columns:
+                columns[name] = [None] * count
+            columns[name].append(value)
+        count += 1
+
+        # Pad the columns this record does not have (e.g. older logs)
+        for name in columns:
+            if len(columns[name]) < count:
+                if name.startswith('gene_'):
+                    columns[name].append(float('nan'))
+                else:
+                    columns[name].append(-1 if name in NUMERIC_COLUMNS else None)
+
+    return columns
@@ -0,0 +1,383 @@
+import os, json, math, time, pickle, statistics
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import engine
+import boardstate
+import corpus
+
+##############################################################################
+# SETTING UP GENERAL CONSTANTS
+##############################################################################
+
+# Headless training helpers. Nothing here needs pygame or tkinter, so worker
+# processes only import the engine.
+
+# Board backend used by headless games (LIST_BACKEND, bitboard or boardstate).
+# All of them play exactly the same moves; only the list board keeps colors,
+# so games drawn on screen use it.
+TRAINING_BACKEND = boardstate
+
+
+##############################################################################
+# FITNESS EVALUATION
+##############################################################################
+
+def evaluate_chromosome(chromosome, seed, max_pieces=None, time_limit=None, profiler=None, metrics=None):
+    """Play one headless game and return score, moves taken, lines removed and censored
+
+    The pieces come from an engine.PieceStream seeded with `seed`, so the
+    result only depends on the chromosome and the seed, whatever process runs
+    it (unless the game is stopped by time_limit). With an engine.Profiler,
+    the phases of the game are printed and added to it. With a
+    metrics.MetricsExporter (only in the process that owns it), every
+    placement is added to it.
+
+    """
+    game_profiler = None
+    if profiler is not None:
+        game_profiler = engine.Profiler()
+
+    renderer = None
+    if metrics is not None:
+        def renderer(board, score, total_lines_removed, moves_taken, next_piece):
+            metrics.record_placement(board, score, total_lines_removed, moves_taken)
+
+    result = engine.play_game(chromosome, backend=TRAINING_BACKEND, max_pieces=max_pieces, time_limit=time_limit,
+                              pieces=engine.PieceStream(seed), profiler=game_profiler, renderer=renderer)
+    if profiler is not None:
+        print(game_profiler.report(f"Game profile of {chromosome}"))
+        profiler.merge(game_profiler)
+
+    return result
+
+
+def timed_evaluate_chromosome(chromosome, seed, max_pieces=None, time_limit=None):
+    """Run evaluate_chromosome and return its result, the process id and the seconds it took"""
+
+    return run_timed(evaluate_chromosome, chromosome, seed, max_pieces, time_limit)
+
+
+def run_timed(function, *args):
+    """Return function(*args), the process id and the seconds the call took"""
+
+    start  = time.perf_counter()
+    result = function(*args)
+
+    return result, os.getpid(), time.perf_counter() - start
+
+
+def make_pool(workers=None):
+    """Create the process pool used to evaluate chromosomes (workers=None: one per core)"""
+
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def evaluate_population(pool, population, seeds, max_pieces=None, time_limit=None, metrics=None):
+    """Evaluate every chromosome in the pool
+
+    Yields (index, (score, moves taken, lines removed, censored), seconds)
+    as soon as each game finishes, so the caller can record results while
+    the others still run. seconds is how long the worker took to play the
+    game. Games are added to the metrics (metrics.MetricsExporter) with the
+    worker that played them.
+
+    """
+    futures = {}
+    for i in range(len(population)):
+        futures[pool.submit(timed_evaluate_chromosome, population[i], seeds[i], max_pieces, time_limit)] = i
+
+    for future in as_completed(futures):
+        result, worker, seconds = future.result()
+        if metrics is not None:
+            metrics.record_game(result, worker, seconds)
+        yield futures[future], result, seconds
+
+
+def evaluate_games(pool, population, seeds, max_pieces=None, time_limit=None, cache=None, batch=False,
+                   profiler=None, metrics=None):
+    """Yield (index, result, seconds) of every chromosome, playing each distinct game once
+
+    Chromosomes with the same values and seed share one game, and games
+    already in the FitnessCache are not played again. Without a pool the
+    games are played here one after another, or all together in lockstep
+    by the NumPy batch simulator (vectorized.play_games_batch) with batch,
+    which does not support a time_limit.
+    seconds is the wall time spent playing the game: 0 for cached games and
+    for the chromosomes sharing the game of another one, and the time from
+    the start of the batch until the game ended with batch.
+    Only games played one after another are profiled by the profiler, and
+    only their placements are added to the metrics as they are played. The
+    games played (not the cached ones) are added to the metrics.
+
+    """
+    pending = {}
+    for i in range(len(population)):
+        key = FitnessCache.make_key(population[i], seeds[i], max_pieces, time_limit)
+        if cache is not None:
+            result = cache.get(key)
+            if result is not None:
+                yield i, result, 0.0
+                continue
+        pending.setdefault(key, []).append(i)
+
+    if batch and time_limit is not None:
+        raise ValueError("batch evaluation cannot play games with a time limit")
+
+    keys  = list(pending)
+    first = [pending[key][0] for key in keys]
+    if batch:
+        import vectorized
+        start = time.perf_counter()
+        games = ((j, result, time.perf_counter() - start)
+                 for j, result in vectorized.play_games_batch([population[i] for i in first],
+                                                              [seeds[i] for i in first], max_pieces, TRAINING_BACKEND))
+    elif pool is None:
+        def play_here():
+            for j in range(len(keys)):
+                result, worker, seconds = run_timed(evaluate_chromosome, population[first[j]], seeds[first[j]],
+                                                    max_pieces, time_limit, profiler, metrics)
+                yield j, result, seconds
+        games = play_here()
+    else:
+        games = evaluate_population(pool, [population[i] for i in first], [seeds[i] for i in first], max_pieces,
+                                    time_limit, metrics)
+
+    for j, result, seconds in games:
+        if metrics is not None and pool is None:
+            metrics.record_game(result)
+        if cache is not None:
+            cache.put(keys[j], result)
+        for i in pending[keys[j]]:
+            yield i, result, seconds
+            seconds = 0.0
+
+
+def evaluate_on_states(chromosome, sample, length):
+    """Score a chromosome on continuations of the sampled corpus states with the training backend
+
+    The backend is picked here rather than passed, since modules cannot be
+    sent to the workers.
+
+    """
+    return corpus.evaluate_on_states(chromosome, sample, length, TRAINING_BACKEND)
+
+
+def evaluate_corpus(pool, population, sample, length):
+    """Yield (index, result, seconds) of every chromosome scored on continuations of the sampled corpus states
+
+    See corpus.evaluate_on_states. Without a pool the chromosomes are scored
+    here one after another. seconds is how long the scoring took.
+
+    """
+    if pool is None:
+        for i in range(len(population)):
+            result, worker, seconds = run_timed(evaluate_on_states, population[i], sample, length)
+            yield i, result, seconds
+        return
+
+    futures = {}
+    for i in range(len(population)):
+        futures[pool.submit(run_timed, evaluate_on_states, population[i], sample, length)] = i
+
+    for future in as_completed(futures):
+        result, worker, seconds = future.result()
+        yield futures[future], result, seconds
+
+
+##############################################################################
+# FITNESS CACHE
+##############################################################################
+
+class FitnessCache:
+    """Game results keyed by (chromosome, piece seed, max_pieces, time_limit)
+
+    Elites and duplicated chromosomes playing a sequence they already played
+    get their result back instead of playing it again. With a path, every
+    new result is appended to that JSON lines file, and the results found
+    there are loaded first, so later runs reuse them. With an
+    experiments.ExperimentStore, results missing here are looked up in it
+    and new ones are added to it. hits and misses count the lookups.
+
+    """
+
+    def __init__(self, path=None, store=None):
+        self.path    = path
+        self.store   = store
+        self.entries = {}
+        self.hits    = 0
+        self.misses  = 0
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        key   = self.make_key(entry['chromosome'], entry['seed'], entry['max_pieces'], entry['time_limit'])
+                        self.entries[key] = tuple(entry['result'])
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(chromosome, seed, max_pieces=None, time_limit=None):
+        return tuple(chromosome), seed, max_pieces, time_limit
+
+    def get(self, key):
+        """Return the result stored for key, or None"""
+
+        result = self.entries.get(key)
+        if result is None and self.store is not None:
+            result = self.store.find_evaluation(*key)
+            if result is not None:
+                self.entries[key] = result
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return result
+
+    def put(self, key, result):
+        """Store a result, appending it to the file and adding it to the store if there are ones"""
+
+        self.entries[key] = tuple(result)
+        if self.store is not None:
+            self.store.add_evaluation(*key, result)
+        if self.path is not None:
+            chromosome, seed, max_pieces, time_limit = key
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'chromosome': list(chromosome), 'seed': seed, 'max_pieces': max_pieces,
+                                    'time_limit': time_limit, 'result': list(result)}) + '\n')
+
+
+##############################################################################
+# CHECKPOINTS
+##############################################################################
+
+def save_checkpoint(path, state):
+    """Pickle the state of a run to path
+
+    The state is written to a temporary file first and then renamed over
+    path, so a run killed while saving keeps its previous checkpoint.
+
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    """Return the state saved by save_checkpoint, or None if there is no checkpoint at path"""
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+##############################################################################
+# RACING
+##############################################################################
+
+def play_round(pool, population, indexes, seed, max_pieces=None, time_limit=None, cache=None, batch=False,
+               metrics=None):
+    """Yield (index, result, seconds) of the chromosomes at indexes, all playing the pieces of seed"""
+
+    chromosomes = [population[i] for i in indexes]
+    for j, result, seconds in evaluate_games(pool, chromosomes, [seed] * len(chromosomes), max_pieces, time_limit,
+                                             cache, batch, metrics=metrics):
+        yield indexes[j], result, seconds
+
+
+def select_tier_games(results):
+    """Return the games of the worst engine.calc_fitness tier of a chromosome and whether they are censored
+
+    A chromosome is censored only if every game was: one game that ended
+    ranks it with the finished games, on the scores of those games alone,
+    so scores are never mixed with points per piece.
+
+    """
+    censored = all(result[3] for result in results)
+
+    return [result for result in results if result[3] == censored], censored
+
+
+def calc_mean_result(results):
+    """Average (score, moves taken, lines removed, censored) of the games of a chromosome in its worst tier
+
+    See select_tier_games: the games of the other tier are left out.
+
+    """
+    games, censored = select_tier_games(results)
+    scores, moves_taken, lines_removed, games_censored = zip(*games)
+
+    return statistics.mean(scores), statistics.mean(moves_taken), statistics.mean(lines_removed), censored
+
+
+def calc_fitness_bounds(results, confidence):
+    """Return the (lower, upper) confidence bounds of the fitness of a chromosome
+
+    The bounds are engine.calc_fitness keys of the mean result, the key
+    selection ranks by: its tier and its value plus or minus confidence
+    standard errors. The standard error is taken over per-game values
+    whose mean is that value: the scores of the games of the tier, divided
+    by the mean number of pieces when censored. With a single game in the
+    tier the bounds are unbounded.
+
+    """
+    score, moves_taken, lines_removed, censored = calc_mean_result(results)
+    tier, value = engine.calc_fitness(score, moves_taken, censored)
+    games, censored = select_tier_games(results)
+    if censored:
+        values = [result[0] / max(moves_taken, 1) for result in games]
+    else:
+        values = [result[0] for result in games]
+
+    margin = math.inf
+    if len(values) > 1:
+        margin = confidence * statistics.stdev(values) / math.sqrt(len(values))
+
+    return (tier, value - margin), (tier, value + margin)
+
+
+def race_population(pool, population, seeds, survivors, min_rounds=3, confidence=2.0, max_pieces=None,
+                    time_limit=None, cache=None, batch=False, metrics=None):
+    """Evaluate the population as a race and yield (index, mean result, eliminated, seconds)
+
+    In every round the chromosomes still racing all play one game with the
+    pieces of the next seed. From min_rounds rounds on, the cutoff is the
+    survivors-th best lower bound of the fitnesses (see calc_fitness_bounds),
+    and a chromosome whose upper bound is below it cannot be selected any
+    more: it stops playing and is yielded as eliminated. The
+    race ends after the last seed, or once only survivors chromosomes are
+    left (at least one round is played) since they are all selected anyway.
+    seconds is the total wall time of the games of the chromosome.
+
+    """
+    results = [[] for chromosome in population]
+    seconds = [0.0 for chromosome in population]
+    racing  = list(range(len(population)))
+
+    for round_number in range(len(seeds)):
+        if round_number > 0 and len(racing) <= survivors:
+            break
+
+        for i, result, game_seconds in play_round(pool, population, racing, seeds[round_number], max_pieces,
+                                                  time_limit, cache, batch, metrics):
+            results[i].append(result)
+            seconds[i] += game_seconds
+
+        if round_number + 1 < max(min_rounds, 2):
+            continue
+
+        bounds = {i: calc_fitness_bounds(results[i], confidence) for i in racing}
+        cutoff = sorted((bounds[i][0] for i in racing), reverse=True)[survivors - 1]
+        for i in racing[:]:
+            if bounds[i][1] < cutoff:
+                racing.remove(i)
+                yield i, calc_mean_result(results[i]), True, seconds[i]
+
+    for i in racing:
+        yield i, calc_mean_result(results[i]), False, seconds[i]